@@ -0,0 +1,91 @@
+"""
+    Compares the disk usage and load time of the chunk formats.
+
+    Usage: python3 -m benchmarks.chunk_format [--chunks N]
+
+    Saves the same generated chunks in the text format, the binary format
+        and the compressed binary format, each in a temporary save, then
+        loads every chunk back.
+"""
+
+import argparse
+import os
+import tempfile
+
+from timeit import default_timer as timer
+
+import saves
+import terrain
+
+from terrain import world_gen
+
+
+def encode_text_chunk(chunk, slice_heights):
+    """ The text format, as the original chunk files. """
+    return b''.join(bytes(chunk[x]) + str(slice_heights[x])[:3].zfill(3).encode() + b'\n' for x in sorted(chunk))
+
+
+FORMATS = (
+    ('text', encode_text_chunk),
+    ('binary', lambda chunk, slice_heights: saves.encode_chunk(chunk, slice_heights, compress=False)),
+    ('binary+zlib', lambda chunk, slice_heights: saves.encode_chunk(chunk, slice_heights, compress=True)),
+)
+
+
+def disk_usage(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def load_all(save, chunk_ns, repeat):
+    """ Returns the fastest time to load every chunk, and the chunks. """
+
+    times = []
+    for _ in range(repeat):
+        saves.close_region_files(save)
+
+        start = timer()
+        chunks = [saves.load_chunk(save, chunk_n) for chunk_n in chunk_ns]
+        times.append(timer() - start)
+
+    return min(times), chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the chunk formats.')
+    parser.add_argument('--chunks', type=int, default=256, help='number of chunks to save')
+    parser.add_argument('--repeat', type=int, default=5, help='times to load them, the fastest is shown')
+    args = parser.parse_args()
+
+    meta = {'seed': 'This is a test!', 'terrain_version': terrain.TERRAIN_VERSION}
+    chunk_ns = range(-(args.chunks // 2), args.chunks - args.chunks // 2)
+    generated = [terrain.gen_chunk(chunk_n, meta) for chunk_n in chunk_ns]
+
+    print('{} chunks of {} slices'.format(args.chunks, world_gen['chunk_size']))
+    print()
+    print('{:<14}{:>12}{:>14}{:>14}'.format('format', 'disk KiB', 'bytes/chunk', 'load ms'))
+
+    with tempfile.TemporaryDirectory() as saves_dir:
+        saves.SAVES_DIR = saves_dir
+
+        for name, encode in FORMATS:
+            os.mkdir(saves.save_path(name))
+
+            size = 0
+            for chunk_n, (chunk, slice_heights) in zip(chunk_ns, generated):
+                data = encode(chunk, slice_heights)
+                saves.write_chunk(name, chunk_n, data)
+                size += len(data)
+
+            load_time, loaded = load_all(name, chunk_ns, args.repeat)
+            saves.close_region_files(name)
+
+            if loaded != generated:
+                print(name, 'chunks are DIFFERENT when loaded')
+
+            print('{:<14}{:>12.1f}{:>14.0f}{:>14.1f}'.format(
+                name, disk_usage(saves.save_path(name, saves.CHUNKS_DIR)) / 1024,
+                size / args.chunks, load_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+    Compares the size and encode/decode time of set_chunks messages in the
+        JSON and binary protocols.
+
+    Usage: python3 -m benchmarks.protocol [--chunks N]
+"""
+
+import argparse
+
+from timeit import default_timer as timer
+
+import protocol
+import terrain
+
+
+PROTOCOLS = (('json', protocol.JSON_PROTOCOL), ('binary', protocol.BINARY_PROTOCOL))
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        func()
+        times.append(timer() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare set_chunks messages in each protocol.')
+    parser.add_argument('--chunks', type=int, default=2, help='chunks in each message')
+    parser.add_argument('--messages', type=int, default=200, help='messages to encode and decode')
+    parser.add_argument('--repeat', type=int, default=5, help='times to time them, the fastest is shown')
+    args = parser.parse_args()
+
+    meta = {'seed': 'This is a test!', 'terrain_version': terrain.TERRAIN_VERSION}
+
+    # The messages the server sends, as Game.get_chunks returns them
+    messages = []
+    for i in range(args.messages):
+        new_slices = {}
+        slice_heights = {}
+        for chunk_n in range(i * args.chunks, (i + 1) * args.chunks):
+            chunk, chunk_slice_heights = terrain.gen_chunk(chunk_n % 64, meta)
+            new_slices.update((x + i * 10000, str(slice_)) for x, slice_ in chunk.items())
+            slice_heights.update((x + i * 10000, height) for x, height in chunk_slice_heights.items())
+        messages.append({'event': 'set_chunks', 'args': [new_slices, slice_heights]})
+
+    print('set_chunks of {} chunks'.format(args.chunks))
+    print()
+    print('{:<8}{:>10}{:>14}{:>14}'.format('format', 'bytes', 'encode us', 'decode us'))
+
+    for name, version in PROTOCOLS:
+        encoded = [protocol.encode(message, version) for message in messages]
+
+        encode_time = best_time(lambda: [protocol.encode(message, version) for message in messages], args.repeat)
+        decode_time = best_time(lambda: [protocol.decode(data) for data in encoded], args.repeat)
+
+        print('{:<8}{:>10.0f}{:>14.1f}{:>14.1f}'.format(
+            name, sum(map(len, encoded)) / len(encoded),
+            1e6 * encode_time / len(messages), 1e6 * decode_time / len(messages)))
+
+
+if __name__ == '__main__':
+    main()
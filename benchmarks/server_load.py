@@ -0,0 +1,124 @@
+"""
+    Compares how the threaded and asyncio servers cope with many clients.
+
+    Usage: python3 -m benchmarks.server_load [--idle N] [--active N]
+
+    For each server, idle clients connect and stay connected, while one
+        client times its round trips. Then active clients all send requests
+        as fast as they get replies.
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+
+from timeit import default_timer as timer
+
+import network
+import protocol
+
+
+SERVERS = (('threaded', network.start_threaded), ('asyncio', network.start_async))
+
+
+def handler(sock, data):
+    """ Replies to get_time, like Server.handle. """
+    if data['event'] == 'get_time':
+        return {'event': 'set_time', 'args': [timer()]}
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, port):
+        return cls(*await asyncio.open_connection('localhost', port))
+
+    async def request(self):
+        """ Returns the time for a get_time round trip. """
+
+        start = timer()
+        self._writer.write(network.frame({'event': 'get_time', 'args': []}, protocol.JSON_PROTOCOL))
+
+        length, = network.HEADER.unpack(await self._reader.readexactly(network.HEADER.size))
+        protocol.decode(await self._reader.readexactly(length))
+        return timer() - start
+
+    def close(self):
+        self._writer.close()
+
+
+def percentiles(times):
+    times = sorted(times)
+    return 1000 * statistics.median(times), 1000 * times[int(len(times) * .99)]
+
+
+async def idle_clients(port, n, probes):
+    """ Connects n clients which wait after one request, then times the
+          probe client's requests. """
+
+    start = timer()
+    clients = await asyncio.gather(*(Client.connect(port) for _ in range(n)))
+    await asyncio.gather(*(client.request() for client in clients))
+    connect_time = timer() - start
+
+    threads = threading.active_count()
+
+    probe = await Client.connect(port)
+    times = [await probe.request() for _ in range(probes)]
+
+    for client in clients + [probe]:
+        client.close()
+
+    return connect_time, threads, percentiles(times)
+
+
+async def active_clients(port, n, requests):
+    """ Returns the requests per second and latency of n clients all sending
+          requests. """
+
+    clients = await asyncio.gather(*(Client.connect(port) for _ in range(n)))
+
+    async def run(client):
+        return [await client.request() for _ in range(requests)]
+
+    start = timer()
+    results = await asyncio.gather(*(run(client) for client in clients))
+    total_time = timer() - start
+
+    for client in clients:
+        client.close()
+
+    return n * requests / total_time, percentiles([t for times in results for t in times])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the threaded and asyncio servers.')
+    parser.add_argument('--idle', type=int, default=1000, help='number of idle clients')
+    parser.add_argument('--active', type=int, default=100, help='number of active clients')
+    parser.add_argument('--requests', type=int, default=100, help='requests sent by each active client')
+    parser.add_argument('--probes', type=int, default=200, help='requests timed with idle clients connected')
+    args = parser.parse_args()
+
+    print('{} idle clients, {} active clients'.format(args.idle, args.active))
+    print()
+    print('{:<10}{:>12}{:>10}{:>14}{:>14}{:>12}{:>14}{:>14}'.format(
+        'server', 'connect ms', 'threads', 'idle p50 ms', 'idle p99 ms', 'active rps', 'active p50 ms', 'active p99 ms'))
+
+    for name, start in SERVERS:
+        port, shutdown = start(handler, 0)
+
+        connect_time, threads, (idle_p50, idle_p99) = asyncio.run(idle_clients(port, args.idle, args.probes))
+        rps, (active_p50, active_p99) = asyncio.run(active_clients(port, args.active, args.requests))
+
+        shutdown()
+
+        print('{:<10}{:>12.0f}{:>10}{:>14.2f}{:>14.2f}{:>12.0f}{:>14.2f}{:>14.2f}'.format(
+            name, connect_time * 1000, threads, idle_p50, idle_p99, rps, active_p50, active_p99))
+
+
+if __name__ == '__main__':
+    main()
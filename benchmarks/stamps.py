@@ -0,0 +1,132 @@
+"""
+    Compares placing trees and ores with the compiled stamps against the
+        original cell by cell builders.
+
+    Usage: python3 -m benchmarks.stamps [--chunks N]
+"""
+
+import argparse
+import copy
+
+from timeit import default_timer as timer
+
+import terrain
+
+from terrain import world_gen, in_chunk, spawn_hierarchy, DEBUG
+
+
+def build_tree_cells(chunk, chunk_pos, x, tree_feature, ground_heights):
+    """ The original tree builder. """
+
+    leaves = world_gen['trees'][tree_feature['type']]['leaves']
+    trunk_depth = terrain.TREE_STAMPS[tree_feature['type']].trunk_depth
+
+    if in_chunk(x, chunk_pos):
+        air_height = world_gen['height'] - ground_heights[x]
+        for trunk_y in range(air_height - tree_feature['height'], air_height - (bool(DEBUG) * 3)):
+            chunk[x][trunk_y] = spawn_hierarchy(('|', chunk[x][trunk_y]))
+
+    half_leaves = int(len(leaves) / 2)
+
+    for leaf_dx, leaf_slice in enumerate(leaves):
+        leaf_x = x + (leaf_dx - half_leaves)
+
+        if in_chunk(leaf_x, chunk_pos):
+            air_height = world_gen['height'] - ground_heights[x]
+            leaf_height = air_height - tree_feature['height'] - len(leaf_slice) + trunk_depth
+
+            for leaf_dy, leaf in enumerate(leaf_slice):
+                if (bool(DEBUG) and leaf_dy == 0) or (not bool(DEBUG) and leaf):
+                    leaf_y = leaf_height + leaf_dy
+                    chunk[leaf_x][leaf_y] = spawn_hierarchy(('@', chunk[leaf_x][leaf_y]))
+
+
+def build_ore_cells(chunk, chunk_pos, x, ore_feature, ore, ground_heights):
+    """ The original ore builder. """
+
+    for block_pos in range(ore['vain_size'] ** 2):
+        if ore_feature['vain_shape'][block_pos] < ore['vain_density']:
+
+            block_dx = (block_pos % ore['vain_size']) - int((ore['vain_size'] - 1) / 2)
+            block_dy = int(block_pos / ore['vain_size']) - int((ore['vain_size'] - 1) / 2)
+
+            block_x = block_dx + x
+            block_y = block_dy + ore_feature['root_height']
+
+            if not in_chunk(block_x, chunk_pos):
+                continue
+
+            if not world_gen['height'] > block_y > world_gen['height'] - ground_heights[block_x]:
+                continue
+
+            if chunk[block_x][block_y] == ' ':
+                continue
+
+            chunk[block_x][block_y] = spawn_hierarchy((ore['char'], chunk[block_x][block_y]))
+
+
+def chunk_jobs(chunk_n, meta):
+    """ Returns the base chunk and the tree and ore features built into it. """
+
+    chunk_pos = chunk_n * world_gen['chunk_size']
+    x_min = chunk_pos - terrain.MAX_HALF_TREE
+    x_max = chunk_pos + world_gen['chunk_size'] + terrain.MAX_HALF_TREE + 1
+
+    ground_heights = {}
+    for region in terrain.regions_overlapping(x_min, x_max, meta, terrain.LANDSCAPE):
+        for x in range(max(x_min, region.x), min(x_max, region.x + terrain.REGION_SIZE)):
+            ground_heights[x] = region.ground_heights[x]
+
+    chunk = terrain.gen_base_chunk(ground_heights, chunk_pos)
+    chunk_x_max = chunk_pos + world_gen['chunk_size']
+
+    trees = terrain.features_overlapping('tree', chunk_pos, chunk_x_max, meta, terrain.DETAILS)
+    ores = [(x, name, feature)
+            for name in terrain.ORE_FEATURES
+            for x, feature in terrain.features_overlapping(name, chunk_pos, chunk_x_max, meta, terrain.DETAILS)]
+
+    return chunk_pos, chunk, ground_heights, trees, ores
+
+
+def build(jobs, build_tree, build_ore, repeat):
+    """ Builds every job's trees and ores into copies of its chunk,
+          returning the fastest time and the chunks. """
+
+    times = []
+    for _ in range(repeat):
+        chunks = copy.deepcopy([job[1] for job in jobs])
+        start = timer()
+
+        for (chunk_pos, _, ground_heights, trees, ores), chunk in zip(jobs, chunks):
+            for x, tree in trees:
+                build_tree(chunk, chunk_pos, x, tree, ground_heights)
+            for x, name, ore_feature in ores:
+                build_ore(chunk, chunk_pos, x, ore_feature, terrain.ORE_FEATURES[name], ground_heights)
+
+        times.append(timer() - start)
+
+    return min(times), chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tree and ore stamps.')
+    parser.add_argument('--chunks', type=int, default=200, help='number of chunks to build')
+    parser.add_argument('--repeat', type=int, default=10, help='times to build them, the fastest is shown')
+    args = parser.parse_args()
+
+    meta = {'seed': 'This is a test!', 'terrain_version': terrain.TERRAIN_VERSION}
+    jobs = [chunk_jobs(chunk_n, meta) for chunk_n in range(args.chunks)]
+
+    cells_time, cells_chunks = build(jobs, build_tree_cells, build_ore_cells, args.repeat)
+    stamps_time, stamps_chunks = build(jobs, terrain.build_tree, terrain.build_ore, args.repeat)
+
+    n_features = sum(len(trees) + len(ores) for *_, trees, ores in jobs)
+
+    print('{} chunks, {} features'.format(args.chunks, n_features))
+    print('cells:  {:.1f} ms'.format(cells_time * 1000))
+    print('stamps: {:.1f} ms ({:.1f}x)'.format(stamps_time * 1000, cells_time / stamps_time))
+    print('identical' if cells_chunks == stamps_chunks else 'DIFFERENT')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+    Measures terrain generation, and checks it still generates the same worlds.
+
+    Usage: python3 -m benchmarks.terrain_gen [--update]
+
+    Generates fixed ranges of chunks for several seeds with each terrain
+        version, and reports chunks/sec with the time split between the
+        feature phases. The hash of every chunk is compared with
+        benchmarks/terrain_golden.json, --update rewrites the file when a
+        change to the generated worlds is intended.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from collections import OrderedDict
+from time import perf_counter
+
+import terrain
+
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), 'terrain_golden.json')
+
+SEEDS = ('This is a test!', 1234, -987654321, 'pycraft')
+CHUNK_RANGES = (range(-8, 8), range(1000, 1004))
+TERRAIN_VERSIONS = (terrain.LEGACY_TERRAIN, terrain.HASH_TERRAIN, terrain.ALIAS_TERRAIN)
+
+# The functions timed for each phase
+PHASES = OrderedDict([
+    ('biome', ('gen_biome_features', 'gen_slices_biome', 'gen_slices_biome_numpy')),
+    ('hill', ('gen_hill_features', 'gen_ground_heights', 'gen_ground_heights_numpy')),
+    ('base', ('gen_base_chunk', 'gen_base_chunk_numpy')),
+    ('cave', ('gen_cave_initial_air', 'gen_cave_features', 'build_cave')),
+    ('tree', ('gen_tree_features', 'build_tree')),
+    ('ore', ('gen_ore_features', 'build_ore')),
+    ('grass', ('gen_grass_features', 'build_grass')),
+])
+
+
+class PhaseTimer:
+    """ Times the phase functions, not counting time spent in any other
+          phase they call. """
+
+    def __init__(self):
+        self.times = OrderedDict((phase, 0) for phase in PHASES)
+        self._stack = []
+        self._start = None
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            self._switch(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._switch(None)
+
+        return timed
+
+    def _switch(self, phase):
+        now = perf_counter()
+        if self._stack:
+            self.times[self._stack[-1]] += now - self._start
+        self._start = now
+
+        if phase is None:
+            self._stack.pop()
+        else:
+            self._stack.append(phase)
+
+    def install(self):
+        """ Replaces the phase functions in the terrain module with timed versions. """
+
+        self._originals = {}
+        for phase, names in PHASES.items():
+            for name in names:
+                self._originals[name] = getattr(terrain, name)
+                setattr(terrain, name, self.wrap(phase, self._originals[name]))
+
+    def uninstall(self):
+        for name, func in self._originals.items():
+            setattr(terrain, name, func)
+
+
+def chunk_hash(chunk, slice_heights):
+    """ Returns a hash of the chunk's blocks and heights. """
+
+    hash_ = hashlib.sha1()
+    for x in sorted(chunk):
+        hash_.update('{}:{}:{}\n'.format(x, slice_heights[x], str(chunk[x])).encode())
+    return hash_.hexdigest()[:16]
+
+
+def run():
+    """ Generates every chunk, returning the hashes, chunks generated,
+          total time and phase timer. """
+
+    hashes = OrderedDict()
+    n_chunks = 0
+    total = 0
+
+    timer = PhaseTimer()
+    timer.install()
+
+    try:
+        for version in TERRAIN_VERSIONS:
+            for seed in SEEDS:
+                meta = {'seed': seed, 'terrain_version': version}
+                seed_hashes = hashes.setdefault(str(version), OrderedDict()).setdefault(str(seed), OrderedDict())
+
+                # Start each seed with nothing cached, as a new game would.
+                terrain.init_features()
+
+                for chunk_range in CHUNK_RANGES:
+                    for chunk_n in chunk_range:
+                        start = perf_counter()
+                        chunk, slice_heights = terrain.gen_chunk(chunk_n, meta)
+                        total += perf_counter() - start
+
+                        seed_hashes[str(chunk_n)] = chunk_hash(chunk, slice_heights)
+                        n_chunks += 1
+    finally:
+        timer.uninstall()
+
+    return hashes, n_chunks, total, timer
+
+
+def report(n_chunks, total, timer):
+    print('{} chunks in {:.2f}s, {:.1f} chunks/sec{}'.format(
+        n_chunks, total, n_chunks / total, '' if terrain.USE_NUMPY else ' (without NumPy)'))
+    print()
+    print('{:<8}{:>12}{:>14}{:>8}'.format('phase', 'ms/chunk', 'chunks/sec', '%'))
+
+    phases = list(timer.times.items())
+    phases.append(('other', total - sum(timer.times.values())))
+
+    for phase, time in phases:
+        print('{:<8}{:>12.2f}{:>14.1f}{:>8.1f}'.format(
+            phase, 1000 * time / n_chunks, n_chunks / time if time else float('inf'), 100 * time / total))
+
+
+def check(hashes):
+    """ Compares the hashes with the golden file, returning the number of differences. """
+
+    try:
+        with open(GOLDEN_FILE) as f:
+            golden = json.load(f)
+    except FileNotFoundError:
+        print('No golden file, run with --update to create it.')
+        return 1
+
+    differences = 0
+    for version, seeds in hashes.items():
+        for seed, chunks in seeds.items():
+            for chunk_n, hash_ in chunks.items():
+                expected = golden.get(version, {}).get(seed, {}).get(chunk_n)
+                if hash_ != expected:
+                    print('Different: terrain version {}, seed {!r}, chunk {}'.format(version, seed, chunk_n))
+                    differences += 1
+
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark terrain generation and check its output.')
+    parser.add_argument('--update', action='store_true', help='write the golden file from this run')
+    args = parser.parse_args()
+
+    hashes, n_chunks, total, timer = run()
+    report(n_chunks, total, timer)
+    print()
+
+    if args.update:
+        with open(GOLDEN_FILE, 'w') as f:
+            json.dump(hashes, f, indent=2)
+            f.write('\n')
+        print('Updated', GOLDEN_FILE)
+
+    else:
+        differences = check(hashes)
+        if differences:
+            print('{} of {} chunks are different'.format(differences, n_chunks))
+            sys.exit(1)
+        print('All chunks match the golden file')
+
+
+if __name__ == '__main__':
+    main()
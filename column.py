@@ -0,0 +1,54 @@
+"""
+    Compact map columns, stored as one byte per block.
+"""
+
+from data import world_gen
+
+
+class Column(bytearray):
+    """
+        A slice of the map, holding the ASCII code of each block's key.
+
+        Positions are read and written as one character block keys, like a
+            list of blocks. The whole column is available without a list per
+            block with bytes(column) or str(column).
+    """
+
+    __slots__ = ()
+
+    def __init__(self, blocks=b''):
+        """ `blocks` is bytes, a str or an iterable of block keys. """
+
+        if isinstance(blocks, str):
+            blocks = blocks.encode('ascii')
+        elif not isinstance(blocks, (bytes, bytearray, memoryview)):
+            blocks = ''.join(blocks).encode('ascii')
+
+        super().__init__(blocks)
+
+    def __getitem__(self, y, _get=bytearray.__getitem__):
+        block = _get(self, y)
+        return chr(block) if block.__class__ is int else block.decode('ascii')
+
+    def __setitem__(self, y, blocks, _set=bytearray.__setitem__):
+        if y.__class__ is int:
+            _set(self, y, ord(blocks))
+        else:
+            _set(self, y, ''.join(blocks).encode('ascii'))
+
+    def __iter__(self):
+        return iter(self.decode('ascii'))
+
+    def __str__(self):
+        return self.decode('ascii')
+
+    def __repr__(self):
+        return 'Column({!r})'.format(str(self))
+
+    def copy(self):
+        return Column(self)
+
+
+def empty_column():
+    """ Returns a column of air. """
+    return Column(b' ' * world_gen['height'])
@@ -1,6 +1,10 @@
 import sys
 import os
 import ast
+import atexit
+
+from collections import deque
+from threading import Thread, Event
 
 
 def _get_terminal_size():
@@ -38,11 +42,92 @@ def supported_chars(*tests):
     return '?' * len(tests[0])
 
 
+class LogWriter:
+    """
+        Writes log lines to the log file from a background thread.
+
+        Lines are kept in a ring buffer until they are written in batches,
+            if the writer falls behind the oldest lines are dropped.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lines = deque(maxlen=LOG_BUFFER_SIZE)
+        self._wake = Event()
+        self._stopping = False
+        self._dropped = 0
+        self._pid = os.getpid()
+
+        self._thread = Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        if len(self._lines) == self._lines.maxlen:
+            self._dropped += 1
+        self._lines.append(line)
+
+        if len(self._lines) >= LOG_BATCH_SIZE:
+            self._wake.set()
+
+    def _writer(self):
+        with open(self._path, 'a') as f:
+            while not self._stopping:
+                self._wake.wait(LOG_FLUSH_INTERVAL)
+                self._wake.clear()
+                self._write_lines(f)
+
+            self._write_lines(f)
+
+    def _write_lines(self, f):
+        lines = []
+        while self._lines:
+            lines.append(self._lines.popleft())
+
+        if self._dropped:
+            lines.insert(0, '[{} log lines dropped]'.format(self._dropped))
+            self._dropped = 0
+
+        if lines:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+
+    def close(self):
+        """ Writes the remaining lines and stops the thread. """
+
+        if self._pid == os.getpid():
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+
+
+_log_writer = None
+def _get_log_writer():
+    global _log_writer
+
+    # Threads don't survive forking, so each process needs its own writer.
+    if _log_writer is None or _log_writer._pid != os.getpid():
+        _log_writer = LogWriter(LOG_FILE)
+        atexit.register(_log_writer.close)
+
+    return _log_writer
+
+
+def log_enabled(m=0):
+    return LOGGING and (m in LOGGING_MODES or 0 in LOGGING_MODES)
+
+
 def log(*args, trunc=True, m=0):
-    if LOGGING and (m in LOGGING_MODES or 0 in LOGGING_MODES):
-        args = (str(arg)[:100] + '...' if trunc and len(str(arg)) > 100 else arg for arg in args)
-        with open(LOG_FILE, 'a') as f:
-            print(*args, file=f)
+    """
+        Logs the args like print, if logging mode m is enabled.
+
+        Callable args are called to get the value to log, so expensive
+            values are only worked out when they will be logged.
+    """
+
+    if log_enabled(m):
+        args = (arg() if callable(arg) else arg for arg in args)
+        args = (str(arg)[:100] + '...' if trunc and len(str(arg)) > 100 else str(arg) for arg in args)
+        _get_log_writer().write(' '.join(args))
 
 
 def in_game_log(string, x, y):
@@ -70,6 +155,10 @@ IN_GAME_LOGGING = getenv_b('PYCRAFT_IN_GAME_LOGGING')
 LOG_FILE = os.getenv('PYCRAFT_LOG_FILE') or 'pycraft.log'
 LOGGING = getenv_b('PYCRAFT_LOGGING')
 
+LOG_BUFFER_SIZE = 10000
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 0.5
+
 WIDTH, HEIGHT = _get_terminal_size()
 CLS = '\033[2J'
 CLS_END = '\033[0J'
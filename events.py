@@ -1,6 +1,6 @@
 from random import random
 
-import render, player
+import grid
 
 
 def process_events(events, server):
@@ -24,20 +24,16 @@ def boom(server, x, y):
     radius = 5
     blast_strength = 85
 
-    for tx in range(x - radius*2, x + radius*2):
-        new_blocks[tx] = {}
+    breakable = grid.column_masks(server.map_, grid.block_table(
+        lambda block: block.get('breakable') and blast_strength >= block['hierarchy']), x - radius, x + radius + 1)
 
-        for ty in range(y - radius, y + radius):
+    blast = grid.intersect(grid.circle_mask(x, y, radius), breakable)
+    inside = grid.circle_mask(x, y, radius - 1)
 
-            if (render.in_circle(tx, ty, x, y, radius) and tx in server.map_ and ty >= 0 and ty < len(server.map_[tx]) and
-                    player.can_strength_break(server.map_[tx][ty], blast_strength)):
-
-                if not render.in_circle(tx, ty, x, y, radius - 1):
-                    if random() < .5:
-                        new_blocks[tx][ty] = ' '
-                else:
-                    new_blocks[tx][ty] = ' '
+    for tx, ty in grid.cells(blast):
+        if (inside.get(tx, 0) >> ty) & 1 or random() < .5:
+            new_blocks.setdefault(tx, {})[ty] = ' '
 
     server.splash_damage(x, y, radius*2, blast_strength/3)
 
-    return new_blocks
\ No newline at end of file
+    return new_blocks
@@ -0,0 +1,196 @@
+"""
+    Bit packed grids of the loaded map, and the algorithms which work on them.
+
+    A grid is a dict of columns {x: int}, where bit y of a column is set for
+        the cells at y which are in the grid. Missing columns are empty.
+"""
+
+from data import world_gen, blocks
+
+
+FULL_COLUMN = (1 << world_gen['height']) - 1
+
+# Neighbours counted by the 3x3 kernels
+NEIGHBOUR_DXS = (-1, 0, 1)
+
+
+def block_table(predicate):
+    """ Returns a bytes.translate table mapping each block of a column to
+          b'1' if predicate(block data) is true, otherwise b'0'. """
+
+    table = bytearray(b'0' * 256)
+    for key, data in blocks.items():
+        if predicate(data):
+            table[ord(key)] = ord('1')
+    return bytes(table)
+
+
+SOLID = block_table(lambda block: block['solid'])
+LIGHTS = block_table(lambda block: block.get('light_radius'))
+
+
+def column_mask(column, table):
+    """ Returns the bits of the column whose blocks are '1' in the table. """
+    return int(bytearray.translate(column, table)[::-1] or b'0', 2)
+
+
+def column_masks(map_, table, x_min, x_max):
+    """ Returns the grid of blocks in map_ which are '1' in the table,
+          from x_min to x_max. """
+    return {x: column_mask(map_[x], table) for x in range(x_min, x_max) if x in map_}
+
+
+def cells(grid):
+    """ Yields the (x, y) position of every cell in the grid, by column
+          then from the top. """
+
+    for x, column in grid.items():
+        while column:
+            low_bit = column & -column
+            yield x, low_bit.bit_length() - 1
+            column ^= low_bit
+
+
+def from_cells(positions):
+    """ Returns the grid containing the (x, y) positions. """
+
+    grid = {}
+    for x, y in positions:
+        if y >= 0:
+            grid[x] = grid.get(x, 0) | (1 << y)
+    return grid
+
+
+def fill_column(seeds, column):
+    """ Fills the runs of the column which contain the seeds. """
+
+    # Kogge-Stone occluded fills, down then up the column
+    seeds &= column
+
+    down, pro, shift = seeds, column, 1
+    while shift < world_gen['height']:
+        down |= pro & (down << shift)
+        pro &= pro << shift
+        shift <<= 1
+
+    up, pro, shift = seeds, column, 1
+    while shift < world_gen['height']:
+        up |= pro & (up >> shift)
+        pro &= pro >> shift
+        shift <<= 1
+
+    return down | up
+
+
+def spread(column):
+    """ Returns the column with each cell grown to its vertical neighbours. """
+    return (column | (column << 1) | (column >> 1)) & FULL_COLUMN
+
+
+def flood_fill(grid, seeds):
+    """ Returns the cells of the grid connected to the seeds, including diagonally. """
+
+    filled = {}
+    to_fill = {x: bits for x, bits in seeds.items() if bits & grid.get(x, 0)}
+
+    while to_fill:
+        x, bits = to_fill.popitem()
+
+        new = fill_column(bits, grid.get(x, 0)) & ~filled.get(x, 0)
+        if not new:
+            continue
+
+        filled[x] = filled.get(x, 0) | new
+
+        # Spread into the neighbouring columns
+        reach = spread(new)
+        for next_x in (x - 1, x + 1):
+            next_bits = reach & grid.get(next_x, 0) & ~filled.get(next_x, 0)
+            if next_bits:
+                to_fill[next_x] = to_fill.get(next_x, 0) | next_bits
+
+    return filled
+
+
+def connected_components(grid):
+    """ Returns a list of the grids of each group of connected cells. """
+
+    remaining = {x: bits for x, bits in grid.items() if bits}
+    components = []
+
+    while remaining:
+        x = min(remaining)
+        component = flood_fill(remaining, {x: remaining[x] & -remaining[x]})
+        components.append(component)
+
+        remaining = subtract(remaining, component)
+
+    return components
+
+
+def subtract(grid, other):
+    """ Returns the cells in grid which aren't in other. """
+
+    difference = {}
+    for x, bits in grid.items():
+        bits &= ~other.get(x, 0)
+        if bits:
+            difference[x] = bits
+    return difference
+
+
+def intersect(grid, other):
+    """ Returns the cells in both grids. """
+
+    intersection = {}
+    for x, bits in grid.items():
+        bits &= other.get(x, 0)
+        if bits:
+            intersection[x] = bits
+    return intersection
+
+
+def dilate(grid, radius=1):
+    """ Grows every cell of the grid into the square of cells `radius` around it. """
+
+    for _ in range(radius):
+        spread_grid = {x: spread(bits) for x, bits in grid.items()}
+
+        grid = {}
+        for x, bits in spread_grid.items():
+            for dx in NEIGHBOUR_DXS:
+                grid[x + dx] = grid.get(x + dx, 0) | bits
+
+    return grid
+
+
+def ellipse_mask(x, y, radius_x, radius_y):
+    """ Returns the grid of cells (tx, ty) inside the ellipse, where
+          (tx - x)^2 / radius_x^2 + (ty - y)^2 / radius_y^2 < 1 """
+
+    grid = {}
+    if radius_x <= 0 or radius_y <= 0:
+        return grid
+
+    for tx in range(x - int(radius_x), x + int(radius_x) + 1):
+        dist_x = ((tx - x) ** 2) / radius_x ** 2
+
+        # Find the run of the column inside the ellipse
+        dy = 0
+        while dist_x + (dy ** 2) / radius_y ** 2 < 1:
+            dy += 1
+
+        if dy:
+            top = max(0, y - dy + 1)
+            bottom = min(world_gen['height'], y + dy)
+
+            if bottom > top:
+                grid[tx] = ((1 << (bottom - top)) - 1) << top
+
+    return grid
+
+
+def circle_mask(x, y, radius):
+    """ Returns the grid of cells inside the circle, as it looks on screen
+          where blocks are twice as tall as they are wide. """
+    return ellipse_mask(x, y, radius, radius / 2)
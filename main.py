@@ -151,7 +151,11 @@ def game(server, settings, benchmarks):
 
             # Update player and mobs position / damage
             move_period = 1 / MPS
-            while frame_start >= move_period + last_move and x in server.map_:
+            if not (x in server.map_ and server.chunk_loaded(x)):
+                # Wait for the player's chunk to load, without catching up afterwards
+                last_move = frame_start
+
+            while frame_start >= move_period + last_move and x in server.map_ and server.chunk_loaded(x):
 
                 dx, dy, jump = player.get_pos_delta_on_input(
                     inp, server.map_, x, y, jump, settings.get('flight'))
@@ -198,8 +202,9 @@ def game(server, settings, benchmarks):
             slice_list = terrain.detect_edges(server.map_, extended_edges)
             if slice_list:
                 log('slices to load', slice_list)
-                chunk_list = terrain.get_chunk_list(slice_list)
-                server.get_chunks(chunk_list)
+
+            # Also fetches the chunks the player is moving towards
+            if server.get_chunks(terrain.get_chunk_list(slice_list), x, extended_edges):
                 server.unload_slices(extended_edges)
 
             # Moving view
@@ -215,8 +220,9 @@ def game(server, settings, benchmarks):
                 old_bk_objects = bk_objects
                 server.redraw = True
 
-            if settings.get('gravity'):
-                blocks = terrain.apply_gravity(server.map_, extended_edges)
+            # Empty slices of chunks which are still loading would make everything fall
+            if settings.get('gravity') and all(server.chunk_loaded(slice_x) for slice_x in range(*extended_edges)):
+                blocks = server.gravity.apply(server.map_, extended_edges)
                 if blocks: server.set_blocks(blocks)
 
             ## Crafting
@@ -0,0 +1,70 @@
+"""
+    Moves the chunk files of saves into region files.
+
+    Usage: python3 migrate_chunks.py [SAVE ...] [--keep]
+
+    Every `.chunk` file in the saves (or all saves) is written to its
+        region file in the binary format, then deleted unless --keep is
+        given. Saves with chunk files still work, so a save can be migrated
+        at any time.
+"""
+
+import argparse
+import os
+import re
+
+import saves
+
+
+CHUNK_FILE = re.compile(r'^(-?\d+)' + re.escape(saves.CHUNK_EXT) + '$')
+
+
+def chunk_files(save):
+    """ Returns the chunk numbers of the save's chunk files. """
+
+    return sorted(int(match.group(1)) for match in map(CHUNK_FILE.match, os.listdir(saves.save_path(save)))
+                  if match)
+
+
+def migrate(save, keep):
+    chunks = chunk_files(save)
+    size = 0
+
+    for chunk_n in chunks:
+        file_name = saves.chunk_file_name(save, chunk_n)
+        with open(file_name, 'rb') as file_:
+            data = file_.read()
+
+        # Chunks already in a region file have been saved since the chunk file
+        if not saves.chunk_in_region(save, chunk_n):
+            saves.write_chunk(save, chunk_n, saves.encode_chunk(*saves.parse_chunk(data, chunk_n)))
+        size += len(data)
+
+        if not keep:
+            os.remove(file_name)
+
+    saves.close_region_files(save)
+
+    regions = os.listdir(saves.save_path(save, saves.CHUNKS_DIR)) if chunks else []
+    print('{}: {} chunk files ({} KiB) to {} region files'.format(save, len(chunks), size // 1024, len(regions)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move the chunk files of saves into region files.')
+    parser.add_argument('saves', nargs='*', help='the save directory names, all saves if none are given')
+    parser.add_argument('--keep', action='store_true', help="don't delete the chunk files")
+    args = parser.parse_args()
+
+    saves.check_map_dir()
+    names = args.saves or [save for save, _ in saves.list_saves()]
+
+    for save in names:
+        if not os.path.isdir(saves.save_path(save)):
+            parser.error('No save called {}'.format(save))
+
+    for save in names:
+        migrate(save, args.keep)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,321 @@ import socket
 import threading
 import socketserver
 import struct
-import json
-import os
+import weakref
 
-from console import log
-import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from console import log, getenv_b
 
-SendLock = threading.Lock()
+import protocol
+
+try:
+    import asyncio
+    from asyncio import BufferedProtocol
+except ImportError:
+    # Before Python 3.7, only the threaded server can be used
+    asyncio = None
+    BufferedProtocol = object
+
+
+# The length of each message, sent before it
+HEADER = struct.Struct('I')
+
+# The most messages waiting to be sent to a socket, before the client is
+#   too far behind and is disconnected
+SEND_QUEUE_SIZE = 256
+# The most bytes of waiting messages written to a socket in one go
+SEND_BATCH_BYTES = 64 * 1024
+
+# The threads the asyncio server handles messages on, as handlers can block
+HANDLER_WORKERS = 8
+# Seconds the servers wait for clients to be sent their last messages
+SHUTDOWN_TIMEOUT = 1
+# Serve every client from one asyncio event loop, instead of a thread each
+ASYNC_SERVER = asyncio is not None and getenv_b('PYCRAFT_ASYNC_SERVER')
+
+# The protocol each socket's messages are sent with
+_protocols = weakref.WeakKeyDictionary()
+
+_send_queues = {}
+_send_queues_lock = threading.Lock()
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    # The listen backlog of asyncio servers, socketserver's is 5
+    request_queue_size = 100
+
+
+class MessageQueue(ABC):
+    """
+        The messages waiting to be sent to a client, so a slow client
+            doesn't hold up the game or the other clients.
+
+        Waiting messages are written together. A waiting message of an event
+            in protocol.MERGES takes the args of newer ones, instead of them
+            being queued. If SEND_QUEUE_SIZE messages are still waiting,
+            the client is disconnected.
+    """
+
+    def __init__(self):
+        self._messages = deque()  # [event, frame, message]
+        self._latest = {}  # {event: its waiting message which can be merged into}
+        self._wake = threading.Condition()
+        self._closing = False
+
+    def put(self, message, version, data=None):
+        """ Queues the message, data is its frame if it's already encoded. """
+
+        event = message['event']
+        if data is None:
+            data = frame(message, version)
+
+        with self._wake:
+            if self._closing:
+                return
+
+            waiting = self._latest.get(event)
+            if waiting is not None:
+                waiting[2] = protocol.merge(waiting[2], message)
+                waiting[1] = data if waiting[2]['args'] is message['args'] else frame(waiting[2], version)
+
+            elif len(self._messages) >= SEND_QUEUE_SIZE:
+                log('Client too far behind, disconnecting')
+                self._messages.clear()
+                self._closing = True
+                self._disconnect()
+
+            else:
+                waiting = [event, data, message]
+                self._messages.append(waiting)
+                if event in protocol.MERGES:
+                    self._latest[event] = waiting
+
+            # Newer messages of these events can't be moved before this one
+            for merge_event in [e for e in self._latest if event in protocol.MERGES[e][1]]:
+                del self._latest[merge_event]
+
+            self._notify()
+
+    def close(self):
+        """ Closes the connection once the waiting messages are sent. """
+        with self._wake:
+            self._closing = True
+            self._notify()
+
+    def _take(self):
+        """ Removes and returns the frames of the next batch of messages. """
+
+        frames = []
+        size = 0
+        while self._messages and size < SEND_BATCH_BYTES:
+            event, data, _ = waiting = self._messages.popleft()
+            if self._latest.get(event) is waiting:
+                del self._latest[event]
+
+            frames.append(data)
+            size += len(data)
+
+        return frames
+
+    @abstractmethod
+    def _notify(self):
+        """ Wakes the writer, called with self._wake held. """
+
+    @abstractmethod
+    def _disconnect(self):
+        """ Drops the connection without sending the waiting messages. """
+
+
+class SendQueue(MessageQueue):
+    """ Sends a socket's messages from its own thread. """
+
+    def __init__(self, sock):
+        super().__init__()
+        self._sock = sock
+
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _notify(self):
+        self._wake.notify()
+
+    def join(self, timeout=None):
+        """ Waits for the waiting messages to be sent, once it's closing. """
+        self._thread.join(timeout)
+
+    def _disconnect(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _writer(self):
+        while True:
+            with self._wake:
+                while not self._messages and not self._closing:
+                    self._wake.wait()
+                frames = self._take()
+
+            if not frames:
+                break
+
+            try:
+                self._sock.sendall(b''.join(frames))
+            except OSError:
+                break
+
+        log('Socket closing')
+        with _send_queues_lock:
+            if _send_queues.get(self._sock) is self:
+                del _send_queues[self._sock]
+        _close_socket(self._sock)
+
+
+class AsyncConnection(MessageQueue, BufferedProtocol):
+    """
+        A client of the asyncio server, which is given to the data handler
+            in place of its socket.
+
+        Each message is received into a buffer of its length, like receive,
+            and they are handled in order on the server's executor. Waiting
+            messages are written while the transport isn't paused.
+    """
+
+    def __init__(self, data_handler, loop, executor):
+        super().__init__()
+        self._data_handler = data_handler
+        self._loop = loop
+        self._executor = executor
+        self._transport = None
+        self._paused = False
+        self._flush_queued = False
+        self._received = asyncio.Queue()
+        self._expect(HEADER.size, header=True)
+
+    def _expect(self, length, header=False):
+        self._buffer = memoryview(bytearray(length))
+        self._filled = 0
+        self._header = header
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+        with _send_queues_lock:
+            _send_queues[self] = self
+
+        self.task = self._loop.create_task(self._handler())
+
+    def connection_lost(self, exc):
+        log('Socket closing')
+
+        with self._wake:
+            self._closing = True
+            self._messages.clear()
+            self._latest.clear()
+
+        with _send_queues_lock:
+            if _send_queues.get(self) is self:
+                del _send_queues[self]
+
+        self._received.put_nowait(None)
+
+    def get_buffer(self, sizehint):
+        return self._buffer[self._filled:]
+
+    def buffer_updated(self, nbytes):
+        self._filled += nbytes
+        if self._filled < len(self._buffer):
+            return
+
+        if self._header:
+            length, = HEADER.unpack(self._buffer)
+            log('data length', length)
+
+            if length:
+                self._expect(length)
+            else:
+                self._transport.close()
+            return
+
+        data = self._buffer
+        self._expect(HEADER.size, header=True)
+
+        log('Received:', lambda: repr(bytes(data)), trunc=False)
+        try:
+            self._received.put_nowait(protocol.decode(data))
+        except (ValueError, IndexError, struct.error) as e:
+            log('Message Error:', e)
+            self._transport.close()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+
+    async def _handler(self):
+        while True:
+            data = await self._received.get()
+            if data is None:
+                break
+
+            try:
+                response = await self._loop.run_in_executor(self._executor, self._data_handler, self, data)
+            except Exception as e:
+                log('Handler Error:', repr(e))
+                self._transport.close()
+                break
+
+            if response:
+                send(self, response)
+
+        log('Handler Exiting')
+
+    def _notify(self):
+        if not self._flush_queued:
+            self._flush_queued = True
+            try:
+                self._loop.call_soon_threadsafe(self._flush)
+            except RuntimeError:
+                # The loop is closed
+                pass
+
+    def _disconnect(self):
+        self._loop.call_soon_threadsafe(self._transport.abort)
+
+    def abort(self):
+        """ Drops the connection, from the event loop. """
+        if self._transport is not None:
+            self._transport.abort()
+
+    def _flush(self):
+        with self._wake:
+            self._flush_queued = False
+
+        if self._transport.is_closing():
+            return
+
+        while not self._paused:
+            with self._wake:
+                frames = self._take()
+                closing = self._closing
+
+            if frames:
+                self._transport.write(b''.join(frames))
+            else:
+                if closing:
+                    self._transport.close()
+                break
 
 
 def connect(ip, port):
@@ -22,61 +325,121 @@ def connect(ip, port):
     return sock
 
 
+def set_protocol(sock, version):
+    _protocols[sock] = version
+
+
+def frame(message, version):
+    """ Returns the message encoded in the protocol, after its length. """
+
+    data = protocol.encode(message, version)
+    log('sending data length', len(data))
+    return HEADER.pack(len(data)) + data
+
+
+def _send_queue(sock):
+    """ Returns the socket's send queue, or None if it's closed. """
+
+    with _send_queues_lock:
+        queue = _send_queues.get(sock)
+
+        # Sockets get a queue when they're first sent to, asyncio clients
+        #   have theirs until they disconnect.
+        if queue is None and isinstance(sock, socket.socket) and sock.fileno() != -1:
+            queue = _send_queues[sock] = SendQueue(sock)
+
+        return queue
+
+
 def send(sock, data):
-    with SendLock:
-        try:
-            data = bytes(json.dumps(data), 'ascii')
-            log('sending data length', len(data))
-            header = struct.pack('I', len(data))
-            sock.sendall(header + data)
-        except OSError:
-            log('Socket closing')
-            sock.close()
+    """ Queues the message to be sent to the socket, or asyncio client. """
 
+    queue = _send_queue(sock)
+    if queue is not None:
+        queue.put(data, _protocols.get(sock, protocol.JSON_PROTOCOL))
 
-def receive(sock):
-    data = None
-    error = False
-    bufsize = 1024
 
+def broadcast(socks, data):
+    """ Queues the message to be sent to every socket, encoding it once for
+          each protocol they use. """
+
+    frames = {}
+
+    for sock in socks:
+        queue = _send_queue(sock)
+        if queue is not None:
+            version = _protocols.get(sock, protocol.JSON_PROTOCOL)
+            if version not in frames:
+                frames[version] = frame(data, version)
+
+            queue.put(data, version, frames[version])
+
+
+def _close_socket(sock):
+    # Shutting down wakes any thread blocked receiving from the socket,
+    #   which would otherwise keep it open.
     try:
-        d = sock.recv(4)
+        sock.shutdown(socket.SHUT_RDWR)
     except OSError:
-        error = True
-    else:
-        if not d:
-            error = True
+        pass
+    sock.close()
 
-    if not error:
-        length = struct.unpack('I', d)[0]
-        log('data length', length)
-        d = bytes()
 
-        try:
-            for i in range(length // bufsize):
-                d += sock.recv(bufsize)
-                time.sleep(0.001)
-            d += sock.recv(length % bufsize)
-        except OSError:
-            error = True
-        else:
-            if not len(d):
-                error = True
+def close(sock, timeout=0):
+    """ Closes the socket, or asyncio client, once its queued messages are
+          sent, waiting up to timeout seconds for a socket's to be sent. """
+
+    with _send_queues_lock:
+        queue = _send_queues.get(sock)
 
-        if not error:
-            data = str(d, 'ascii')
-            log('real length', len(d))
+    if queue is not None:
+        queue.close()
+        if timeout and isinstance(queue, SendQueue):
+            queue.join(timeout)
+    elif isinstance(sock, socket.socket):
+        _close_socket(sock)
 
-    if error:
+
+def _recv_into(sock, view):
+    """ Fills the view from the socket, returns False if it closes first. """
+
+    while view:
+        n = sock.recv_into(view)
+        if not n:
+            return False
+        view = view[n:]
+
+    return True
+
+
+def receive(sock):
+    data = None
+
+    try:
+        header = bytearray(HEADER.size)
+        if _recv_into(sock, memoryview(header)):
+            length, = HEADER.unpack(header)
+            log('data length', length)
+
+            # Each message gets its own buffer, as the decoded message can
+            #   keep views into it.
+            data = memoryview(bytearray(length))
+            if not length or not _recv_into(sock, data):
+                data = None
+    except OSError:
+        data = None
+
+    if data is None:
         log('Socket closing')
-        sock.close()
+        close(sock)
 
     else:
-        log('Received:', repr(data), trunc=False)
+        log('Received:', lambda: repr(bytes(data)), trunc=False)
         try:
-            return json.loads(data)
-        except ValueError as e:
-            log('JSON Error:', e)
+            return protocol.decode(data)
+        except (ValueError, IndexError, struct.error) as e:
+            log('Message Error:', e)
+            close(sock)
 
 
 def requestHandlerFactory(data_handler):
@@ -86,23 +449,29 @@ def requestHandlerFactory(data_handler):
             super().__init__(*args)
 
         def handle(self):
-            while True:
-                data = receive(self.request)
+            try:
+                while True:
+                    data = receive(self.request)
 
-                if data:
-                    response = self.data_handler(self.request, data)
+                    if data:
+                        response = self.data_handler(self.request, data)
 
-                    if response:
-                        send(self.request, response)
-                else:
-                    break
+                        if response:
+                            send(self.request, response)
+                    else:
+                        break
+            finally:
+                # The server closes the socket once this returns, so the
+                #   waiting messages are sent first. This also stops the
+                #   socket's send queue if the handler failed.
+                close(self.request, SHUTDOWN_TIMEOUT)
 
             log('Handler Exiting')
 
     return ThreadedTCPRequestHandler
 
 
-def start(data_handler, port):
+def start_threaded(data_handler, port):
     # Port 0 means to select an arbitrary unused port
     HOST, PORT = '0.0.0.0', int(port)
 
@@ -117,3 +486,63 @@ def start(data_handler, port):
     server_thread.start()
 
     return port, server.shutdown
+
+
+def start_async(data_handler, port, executor=None):
+    """ Serves every client from one asyncio event loop on a background
+          thread. Messages are handled on the executor, by default a pool
+          of HANDLER_WORKERS threads. """
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(HANDLER_WORKERS, thread_name_prefix='handler')
+
+    loop = asyncio.new_event_loop()
+    connections = weakref.WeakSet()
+
+    def connection():
+        conn = AsyncConnection(data_handler, loop, executor)
+        connections.add(conn)
+        return conn
+
+    server = loop.run_until_complete(loop.create_server(connection, '0.0.0.0', int(port)))
+    port = server.sockets[0].getsockname()[1]
+
+    server_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    server_thread.start()
+
+    async def close():
+        """ Stops listening, and disconnects the clients once their waiting
+              messages are sent. """
+
+        server.close()
+        for conn in connections:
+            conn.close()
+
+        tasks = [conn.task for conn in connections]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for conn in connections:
+            conn.abort()
+
+    def shutdown():
+        asyncio.run_coroutine_threadsafe(close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        server_thread.join()
+        loop.close()
+
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    return port, shutdown
+
+
+def start(data_handler, port):
+    if ASYNC_SERVER:
+        return start_async(data_handler, port)
+    else:
+        return start_threaded(data_handler, port)
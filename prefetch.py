@@ -0,0 +1,118 @@
+"""
+    Decides which chunks to request from the server, fetching the chunks the
+        player is moving towards before they reach the edge of the view.
+"""
+
+from collections import deque
+from math import floor, ceil
+from time import time
+
+from data import world_gen
+
+
+chunk_size = world_gen['chunk_size']
+
+PREFETCH_WINDOW = 4  # Chunks being fetched at once, chunks the view needs are fetched regardless
+PREFETCH_TIME = 2  # Seconds of movement to fetch ahead
+PREFETCH_MAX_CHUNKS = 4  # Furthest to fetch ahead
+VELOCITY_TIME = 1  # Seconds of movement to average the velocity over
+
+
+def chunks_between(edges):
+    """ Returns the chunks containing the slices from edges[0] to edges[1]. """
+    return range(floor(edges[0] / chunk_size), ceil(edges[1] / chunk_size))
+
+
+class ChunkPrefetcher:
+    """
+        Tracks the requested chunks, and which chunks to request next.
+
+        Chunks in the view are always requested. Chunks ahead of the player
+            are requested while there is space in the window, nearest first,
+            and cancelled once they are behind the player.
+    """
+
+    def __init__(self, window=PREFETCH_WINDOW):
+        self.window = window
+        self.in_flight = set()
+
+        self._positions = deque()
+
+    def move(self, x, t=None):
+        """ Records the player's position. """
+
+        t = time() if t is None else t
+
+        self._positions.append((t, x))
+        while len(self._positions) > 2 and t - self._positions[1][0] >= VELOCITY_TIME:
+            self._positions.popleft()
+
+    @property
+    def velocity(self):
+        """ Slices per second. """
+
+        if len(self._positions) < 2:
+            return 0
+
+        (t0, x0), (t1, x1) = self._positions[0], self._positions[-1]
+        return (x1 - x0) / (t1 - t0) if t1 > t0 else 0
+
+    def ahead(self, edges):
+        """ Returns the chunks the player is moving towards beyond the edges, nearest first. """
+
+        distance = self.velocity * PREFETCH_TIME
+        if not distance:
+            return []
+
+        n_chunks = min(PREFETCH_MAX_CHUNKS, max(1, ceil(abs(distance) / chunk_size)))
+        view = chunks_between(edges)
+
+        if distance > 0:
+            return list(range(view[-1] + 1, view[-1] + 1 + n_chunks))
+        else:
+            return list(range(view[0] - 1, view[0] - 1 - n_chunks, -1))
+
+    def keep_edges(self, edges):
+        """ The edges of the slices to keep loaded, so the chunks ahead
+              aren't unloaded before the player gets to them. """
+
+        margin = PREFETCH_MAX_CHUNKS * chunk_size
+        return edges[0] - margin, edges[1] + margin
+
+    def schedule(self, needed, edges, loaded):
+        """
+            Returns the chunks to request and the requests to cancel.
+
+            Takes:
+            - needed: chunks which the view needs now
+            - edges: the edges of the view
+            - loaded: function returning whether a chunk is already loaded
+        """
+
+        needed = [chunk for chunk in needed if chunk not in self.in_flight]
+        ahead = [chunk for chunk in self.ahead(edges) if not loaded(chunk)]
+
+        # Cancel the chunks which are now behind the player, or too far away
+        view = chunks_between(edges)
+        keep = chunks_between(self.keep_edges(edges))
+        velocity = self.velocity
+
+        cancel = [chunk for chunk in self.in_flight
+                  if chunk not in keep or
+                     (velocity > 0 and chunk < view[0]) or
+                     (velocity < 0 and chunk > view[-1])]
+        self.in_flight.difference_update(cancel)
+
+        request = needed
+        for chunk in ahead:
+            if len(self.in_flight) + len(request) >= self.window:
+                break
+            if chunk not in self.in_flight and chunk not in request:
+                request.append(chunk)
+
+        self.in_flight.update(request)
+        return request, cancel
+
+    def received(self, chunk_list):
+        """ Marks the chunks as no longer being fetched. """
+        self.in_flight.difference_update(chunk_list)
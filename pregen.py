@@ -0,0 +1,134 @@
+"""
+    Generates the terrain for a range of chunks in a save ahead of time,
+        so players don't have to wait for it while exploring.
+
+    Usage: python3 pregen.py SAVE START END [--workers N] [--batch N]
+
+    Chunks START to END - 1 are generated. Chunks which are already saved
+        are skipped, so an interrupted run can be resumed by running the same
+        command again.
+"""
+
+import argparse
+import os
+import sys
+
+from multiprocessing import Pool, cpu_count
+from time import time
+
+import saves, terrain
+
+
+def missing_batches(save, start, end, batch_size):
+    """ Splits the unsaved chunks between start and end into contiguous batches. """
+
+    batches = []
+    batch = []
+
+    for chunk_n in range(start, end):
+        if saves.chunk_exists(save, chunk_n):
+            if batch:
+                batches.append(batch)
+            batch = []
+        else:
+            batch.append(chunk_n)
+            if len(batch) == batch_size:
+                batches.append(batch)
+                batch = []
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+class WorkerRegionStore(terrain.RegionStore):
+    """
+        Loads the save's stored regions in a worker, but keeps the regions
+            it would write, to be returned to the main process.
+
+        Workers can generate different parts of the same region, so if they
+            wrote it themselves the last one would replace the others'.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.written = {}
+
+    def _write(self, key, region):
+        self.written[key] = region
+
+
+def init_worker(save):
+    terrain.init_features(WorkerRegionStore(saves.save_path(save, saves.REGIONS_DIR)))
+
+
+def gen_batch(args):
+    """ Generates a contiguous batch of chunks in one worker, so they share
+          the worker's cached terrain features. Returns the chunks and the
+          regions which have changed. """
+
+    meta, batch = args
+    results = [(chunk_n,) + terrain.gen_chunk(chunk_n, meta) for chunk_n in batch]
+
+    # The pool's workers are killed when it closes, so the regions are
+    #   returned after every batch.
+    terrain.flush_regions()
+    regions, terrain.region_store.written = terrain.region_store.written, {}
+
+    return results, regions
+
+
+def pregen(save, start, end, workers, batch_size):
+    meta = saves.get_meta(save)
+
+    batches = missing_batches(save, start, end, batch_size)
+    total = sum(map(len, batches))
+
+    print('Generating {} of {} chunks with {} workers'.format(total, end - start, workers))
+
+    done = 0
+    start_time = time()
+
+    # Workers share the save's stored regions, so features are only
+    #   generated once. Only this process writes them, merging each worker's
+    #   changes into the stored regions.
+    store = saves.region_store(save)
+
+    with Pool(workers, init_worker, (save,)) as pool:
+        for results, regions in pool.imap_unordered(gen_batch, ((meta, batch) for batch in batches)):
+            for chunk_n, chunk, slice_heights in results:
+                saves.save_chunk(save, chunk_n, chunk, slice_heights)
+
+            for key, region in regions.items():
+                store.merge(key, region)
+
+            done += len(results)
+            rate = done / (time() - start_time)
+
+            print('\r{}/{} chunks, {:.1f} chunks/sec'.format(done, total, rate), end='')
+            sys.stdout.flush()
+
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pregenerate the terrain for a save.')
+    parser.add_argument('save', help='the save directory name')
+    parser.add_argument('start', type=int, help='first chunk to generate')
+    parser.add_argument('end', type=int, help='chunk to stop before')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='number of worker processes')
+    parser.add_argument('--batch', type=int, default=16, help='chunks generated in each batch')
+    args = parser.parse_args()
+
+    if not os.path.isdir(saves.save_path(args.save)):
+        parser.error('No save called {}'.format(args.save))
+
+    try:
+        pregen(args.save, args.start, args.end, args.workers, args.batch)
+    except KeyboardInterrupt:
+        print('\nInterrupted, run again to resume.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+    Encodes the messages sent between the server and clients.
+
+    Messages are dicts of an event and its args. They are encoded as JSON,
+        which every client understands, or in the binary protocol, which
+        clients ask for when they log in.
+
+    A binary message is the event's ID followed by its args, with packed
+        fields for the frequent events and JSON for the rest. JSON messages
+        always start with '{', which isn't an ID, so either can be decoded.
+"""
+
+import json
+import struct
+
+
+JSON_PROTOCOL = 0
+BINARY_PROTOCOL = 1
+PROTOCOL_VERSION = BINARY_PROTOCOL
+
+# Message IDs, which must only be added to the end
+EVENTS = (
+    'login', 'logout', 'error', 'set_protocol',
+    'get_chunks', 'set_chunks', 'unload_slices', 'set_blocks',
+    'get_players', 'set_player', 'set_players', 'remove_player', 'respawn',
+    'get_mobs', 'set_mobs', 'get_items', 'set_items', 'add_items', 'remove_items',
+    'get_time', 'set_time', 'player_attack', 'splash_damage'
+)
+EVENT_IDS = {event: i for i, event in enumerate(EVENTS, 1)}
+
+MESSAGE_ID = struct.Struct('<B')
+COUNT = struct.Struct('<H')
+CHUNK_N = struct.Struct('<i')
+COLUMN = struct.Struct('<iHH')  # x, slice height, length of blocks
+BLOCK = struct.Struct('<iHc')  # x, y, block
+TIME = struct.Struct('<d')
+
+
+def encode_get_chunks(chunk_list):
+    return COUNT.pack(len(chunk_list)) + b''.join(CHUNK_N.pack(chunk_n) for chunk_n in chunk_list)
+
+
+def decode_get_chunks(data):
+    count, = COUNT.unpack_from(data)
+    return [[chunk_n for chunk_n, in CHUNK_N.iter_unpack(data[COUNT.size:COUNT.size + count * CHUNK_N.size])]]
+
+
+def encode_set_chunks(new_slices, slice_heights):
+    """ Each column's header, then the blocks of every column. """
+
+    columns = [(int(x), slice_.encode('ascii') if isinstance(slice_, str) else bytes(slice_))
+               for x, slice_ in new_slices.items()]
+
+    return b''.join(
+        [COUNT.pack(len(columns))] +
+        [COLUMN.pack(x, int(slice_heights[x]), len(blocks)) for x, blocks in columns] +
+        [blocks for _, blocks in columns]
+    )
+
+
+def decode_set_chunks(data):
+    count, = COUNT.unpack_from(data)
+    headers = COLUMN.iter_unpack(data[COUNT.size:COUNT.size + count * COLUMN.size])
+
+    new_slices = {}
+    slice_heights = {}
+
+    start = COUNT.size + count * COLUMN.size
+    for x, slice_height, length in headers:
+        new_slices[x] = data[start:start + length]
+        slice_heights[x] = slice_height
+        start += length
+
+    return [new_slices, slice_heights]
+
+
+def encode_set_blocks(blocks):
+    blocks = [(int(x), int(y), block.encode('ascii')) for x, column in blocks.items() for y, block in column.items()]
+    return COUNT.pack(len(blocks)) + b''.join(BLOCK.pack(*block) for block in blocks)
+
+
+def decode_set_blocks(data):
+    count, = COUNT.unpack_from(data)
+
+    blocks = {}
+    for x, y, block in BLOCK.iter_unpack(data[COUNT.size:COUNT.size + count * BLOCK.size]):
+        blocks.setdefault(x, {})[y] = block.decode('ascii')
+
+    return [blocks]
+
+
+def encode_set_time(time):
+    return TIME.pack(time)
+
+
+def decode_set_time(data):
+    return list(TIME.unpack_from(data))
+
+
+CODECS = {
+    'get_chunks': (encode_get_chunks, decode_get_chunks),
+    'set_chunks': (encode_set_chunks, decode_set_chunks),
+    'set_blocks': (encode_set_blocks, decode_set_blocks),
+    'set_time': (encode_set_time, decode_set_time),
+}
+
+# Events where a client only needs the latest state, so an unsent message
+#   can take the args of a newer one. Each has a function merging the args
+#   of both, and the events sent in between which stop the newer state
+#   being moved before them.
+MERGES = {
+    'set_players': (lambda old, new: [dict(old[0], **new[0])], {'remove_player', 'logout'}),
+    'set_mobs': (lambda old, new: new, set()),
+    'set_time': (lambda old, new: new, set()),
+}
+
+
+def merge(old, new):
+    """ Returns the message of both messages' args, of an event in MERGES. """
+    return {'event': new['event'], 'args': MERGES[new['event']][0](old['args'], new['args'])}
+
+
+def _json_default(value):
+    # Columns are sent as strings of their blocks
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('ascii')
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def encode(message, protocol=JSON_PROTOCOL):
+    """ Returns the message's bytes in the protocol. """
+
+    event = message['event']
+
+    # Messages with extra fields, or events the binary protocol doesn't
+    #   have, are always sent as JSON.
+    if protocol >= BINARY_PROTOCOL and event in EVENT_IDS and len(message) <= 2:
+        args = message.get('args', [])
+
+        if event in CODECS:
+            body = CODECS[event][0](*args)
+        else:
+            body = json.dumps(args, default=_json_default).encode()
+
+        return MESSAGE_ID.pack(EVENT_IDS[event]) + body
+
+    return bytes(json.dumps(message, default=_json_default), 'ascii')
+
+
+def decode(data):
+    """ Returns the message from its bytes in either protocol. """
+
+    if data[:1] == b'{':
+        return json.loads(str(data, 'ascii'))
+
+    event_id, = MESSAGE_ID.unpack_from(data)
+    if not 0 < event_id <= len(EVENTS):
+        raise ValueError('Unknown message ID {}'.format(event_id))
+
+    event = EVENTS[event_id - 1]
+    body = memoryview(data)[MESSAGE_ID.size:]
+
+    if event in CODECS:
+        args = CODECS[event][1](body)
+    else:
+        args = json.loads(str(body, 'utf-8'))
+
+    return {'event': event, 'args': args}
@@ -5,15 +5,13 @@ from console import *
 from data import lighting, world_gen, blocks, timings
 from terrain import is_solid
 
+import grid
+
 
 sun_y = world_gen['height'] - world_gen['ground_height']
 max_light = max(map(lambda b: b.get('light_radius', 0), blocks.values()))
 
 
-def in_circle(test_x, test_y, x, y, r):
-    return circle_dist(test_x, test_y, x, y, r) < 1
-
-
 def circle_dist(test_x, test_y, x, y, r):
     return ( ( ((test_x - x) ** 2) /  r    ** 2) +
              ( ((test_y - y) ** 2) / (r/2) ** 2) )
@@ -52,6 +50,8 @@ def render_map(map_, slice_heights, edges, edges_y, objects, bk_objects, sky_col
     if redraw_all:
         last_frame = {}
 
+    mask_lights(lights, map_, slice_heights)
+
     objects = list(filter(lambda o: (o['x'] >= 0 and o['x'] <= (edges[1] - edges[0])) and
                                     (o['y'] >= edges_y[0] and o['y'] <= edges_y[1]), objects))
 
@@ -242,19 +242,33 @@ def get_light_colour(x, y, world_x, map_, slice_heights, lights, colour_behind,
     return light
 
 
-def light_mask(x, y, map_, slice_heights):
-    if is_solid(map_[x][y]) or (world_gen['height'] - y) < slice_heights[x]:
-        z = 0
-    else:
-        z = -1
-    return z
+def light_masks(map_, slice_heights, x_min, x_max):
+    """ Returns the grid of blocks which hide lights behind them:
+          solid blocks, and everything underground. """
+
+    masks = grid.column_masks(map_, grid.SOLID, x_min, x_max)
+    for x in masks:
+        masks[x] |= grid.FULL_COLUMN & ~((1 << (world_gen['height'] - slice_heights[x] + 1)) - 1)
+
+    return masks
+
+
+def mask_lights(lights, map_, slice_heights):
+    """ Sets the z each light has to be in front of to be seen. """
+
+    if not lights:
+        return
+
+    masks = light_masks(map_, slice_heights, min(l['x'] for l in lights), max(l['x'] for l in lights) + 1)
+    for l in lights:
+        l['mask'] = 0 if l['y'] >= 0 and (masks.get(l['x'], 0) >> l['y']) & 1 else -1
 
 
 def get_block_lightness(x, y, world_x, map_, slice_heights, lights):
     block_lights = get_block_lights(world_x, x, y, lights)
 
     # If the light is not hidden by the mask
-    block_lights = filter(lambda l: l['z'] >= light_mask(l['x'], l['y'], map_, slice_heights), block_lights)
+    block_lights = filter(lambda l: l['z'] >= l['mask'], block_lights)
 
     # Multiply the distance from the source by the lightness of the source colour.
     block_lights_lightness = map(lambda l: l['distance'] * lightness(l['colour']), block_lights)
@@ -393,22 +407,16 @@ def get_lights(_map, bk_objects, player_x):
     }, filter(lambda obj: obj.get('light_radius'), bk_objects)))
 
     # Give blocks light
-    for world_x, slice_ in _map.items():
-        # Get the lights and their y positions in this slice
-        slice_lights = filter(lambda pixel: blocks[pixel[1]].get('light_radius'),
-            zip(range(len(slice_)), slice_)) # [(0, ' '), (1, '~'), ...]
-
-        # Convert light pixels to light objects
-        lights.extend(map(
-            lambda pixel: {
-                'radius': blocks[pixel[1]]['light_radius'],
-                'x': world_x,
-                'y': pixel[0],
-                'z': 0,
-                'colour': blocks[pixel[1]].get('light_colour', (1,1,1))
-            },
-            slice_lights
-        ))
+    for world_x, y in grid.cells({world_x: grid.column_mask(slice_, grid.LIGHTS) for world_x, slice_ in _map.items()}):
+        block = blocks[_map[world_x][y]]
+
+        lights.append({
+            'radius': block['light_radius'],
+            'x': world_x,
+            'y': y,
+            'z': 0,
+            'colour': block.get('light_colour', (1,1,1))
+        })
 
     return lights
 
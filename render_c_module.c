@@ -111,18 +111,9 @@ get_block(long x, long y, PyObject *map)
     wchar_t result = 0;
 
     PyObject *column = PyDict_GetItem(map, PyLong_FromLong(x));
-    if (column)
+    if (column && PyByteArray_Check(column) && y >= 0 && y < PyByteArray_GET_SIZE(column))
     {
-        PyObject *block = NULL;
-        if (y < PyList_Size(column))
-        {
-            block = PyList_GetItem(column, y);
-        }
-
-        if (block)
-        {
-            result = PyString_AsChar(block);
-        }
+        result = (unsigned char)PyByteArray_AS_STRING(column)[y];
     }
 
     return result;
@@ -973,9 +964,9 @@ render_map(PyObject *self, PyObject *args)
         if (!(world_x_l >= left_edge && world_x_l < right_edge))
             continue;
 
-        if (!PyList_Check(column))
+        if (!PyByteArray_Check(column))
         {
-            PyErr_SetString(C_RENDERER_EXCEPTION, "Column is not a list!");
+            PyErr_SetString(C_RENDERER_EXCEPTION, "Column is not a bytearray!");
             return NULL;
         }
 
@@ -983,18 +974,17 @@ render_map(PyObject *self, PyObject *args)
 
         long slice_height = PyFloat_AsDouble(PyDict_GetItem(slice_heights, PyLong_FromLong(world_x_l)));
 
-        PyObject *iter = PyObject_GetIter(column);
-        PyObject *py_pixel;
-        long world_y_l = 0;
+        const char *blocks = PyByteArray_AS_STRING(column);
+        long column_height = PyByteArray_GET_SIZE(column);
 
-        while ((py_pixel = PyIter_Next(iter)))
+        for (long world_y_l = 0; world_y_l < column_height; ++world_y_l)
         {
             if (world_y_l >= top_edge && world_y_l < bottom_edge)
             {
                 long screen_y = world_y_l - top_edge;
                 bool underground = world_y_l > world_gen_height - slice_height;
 
-                wchar_t pixel = PyString_AsChar(py_pixel);
+                wchar_t pixel = (unsigned char)blocks[world_y_l];
                 if (!pixel)
                 {
                     PyErr_SetString(C_RENDERER_EXCEPTION, "Cannot get char from pixel!");
@@ -1010,12 +1000,7 @@ render_map(PyObject *self, PyObject *args)
                         return NULL;
                 }
             }
-
-            ++world_y_l;
-            Py_XDECREF(py_pixel);
         }
-
-        Py_XDECREF(iter);
     }
 
     if (settings.terminal_output > 0)
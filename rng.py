@@ -0,0 +1,200 @@
+"""
+    Random number streams for terrain generation.
+
+    Each terrain feature check draws from a stream keyed by
+        (seed, x, feature name).
+"""
+
+import random
+from hashlib import sha256
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MASK = 2 ** 64 - 1
+GOLDEN = 0x9e3779b97f4a7c15
+
+
+def _key(value):
+    """ Stable 64 bit key for a seed or feature name. """
+    return int.from_bytes(sha256(str(value).encode()).digest()[:8], 'little')
+
+
+def _mix(z):
+    """ SplitMix64 finaliser. """
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK
+    return z ^ (z >> 31)
+
+
+def _mix_numpy(z):
+    """ SplitMix64 finaliser over a uint64 array, wrapping like `_mix`. """
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+    return z ^ (z >> numpy.uint64(31))
+
+
+def _to_float(z):
+    return (z >> 11) * (1 / 2 ** 53)
+
+
+class HashStream:
+    """
+        A stream of values for one (seed, x, feature).
+
+        The nth value is a hash of the stream key and n, so there is no
+            state to seed and any value can be computed directly.
+    """
+
+    def __init__(self, stream_key, counter=0):
+        self._stream_key = stream_key
+        self._counter = counter
+
+    def random(self):
+        self._counter += 1
+        return _to_float(_mix((self._stream_key + self._counter * GOLDEN) & MASK))
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def sample(self, population, k):
+        # Partial Fisher-Yates shuffle
+        pool = list(population)
+        for i in range(k):
+            j = i + int(self.random() * (len(pool) - i))
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
+
+
+class HashRNG:
+    """ Stateless hash based random numbers. """
+
+    def __init__(self, seed):
+        self._seed_key = _key(seed)
+        self._name_keys = {}
+
+    def _base_key(self, name):
+        try:
+            return self._name_keys[name]
+        except KeyError:
+            base_key = self._name_keys[name] = self._seed_key ^ _key(name)
+            return base_key
+
+    def _stream_key(self, x, name):
+        return _mix((self._base_key(name) + x * GOLDEN) & MASK)
+
+    def stream(self, x, name, skip=0):
+        """ Returns the stream for `x`, with the first `skip` values skipped. """
+        return HashStream(self._stream_key(x, name), skip)
+
+    def random(self, xs, name, counter=0):
+        """ Returns the `counter`th value of the stream for each x in `xs`. """
+
+        if numpy is not None:
+            with numpy.errstate(over='ignore'):
+                xs = numpy.asarray(xs, dtype=numpy.int64).view(numpy.uint64)
+                stream_keys = _mix_numpy(numpy.uint64(self._base_key(name)) + xs * numpy.uint64(GOLDEN))
+                values = _mix_numpy(stream_keys + numpy.uint64(((counter + 1) * GOLDEN) & MASK))
+                return ((values >> numpy.uint64(11)) * (1 / 2 ** 53)).tolist()
+        else:
+            return [self.stream(x, name, counter).random() for x in xs]
+
+    def randoms(self, x, name, n):
+        """ Returns the first `n` values of the stream for `x`. """
+
+        if numpy is not None:
+            with numpy.errstate(over='ignore'):
+                counters = numpy.arange(1, n + 1, dtype=numpy.uint64)
+                values = _mix_numpy(numpy.uint64(self._stream_key(x, name)) + counters * numpy.uint64(GOLDEN))
+                return ((values >> numpy.uint64(11)) * (1 / 2 ** 53)).tolist()
+        else:
+            stream = self.stream(x, name)
+            return [stream.random() for _ in range(n)]
+
+
+class LegacyRNG:
+    """
+        The original terrain random numbers: the Mersenne Twister
+            reseeded with a string for every feature check.
+    """
+
+    def __init__(self, seed):
+        self._seed = str(seed)
+        self._random = random.Random()
+
+    def stream(self, x, name, skip=0):
+        """ Returns the stream for `x`, with the first `skip` values skipped. """
+
+        self._random.seed(self._seed + str(x) + name)
+        for _ in range(skip):
+            self._random.random()
+        return self._random
+
+    def random(self, xs, name, counter=0):
+        """ Returns the `counter`th value of the stream for each x in `xs`. """
+        return [self.stream(x, name, counter).random() for x in xs]
+
+    def randoms(self, x, name, n):
+        """ Returns the first `n` values of the stream for `x`. """
+        stream = self.stream(x, name)
+        return [stream.random() for _ in range(n)]
+
+
+class AliasTable:
+    """
+        Weighted choice in constant time, using Vose's alias method.
+
+        The items are split into equal width columns, each holding part of
+            one item's weight and the rest from its alias, so a draw needs
+            one uniform value.
+    """
+
+    def __init__(self, items, weights):
+        self.items = list(items)
+
+        n = len(self.items)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights]
+
+        self._probs = [1] * n
+        self._aliases = list(range(n))
+
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+
+        while small and large:
+            i, j = small.pop(), large.pop()
+
+            self._probs[i] = scaled[i]
+            self._aliases[i] = j
+
+            scaled[j] -= 1 - scaled[i]
+            (small if scaled[j] < 1 else large).append(j)
+
+    def sample(self, random):
+        """ Returns an item, using one value from the stream `random`. """
+
+        column, fraction = divmod(random.random() * len(self.items), 1)
+        column = int(column)
+
+        if fraction < self._probs[column]:
+            return self.items[column]
+        else:
+            return self.items[self._aliases[column]]
+
+
+_rngs = {}
+def feature_rng(seed, hashed):
+    """ Returns the (cached) RNG for a seed. """
+
+    try:
+        return _rngs[seed, hashed]
+    except KeyError:
+        rng = _rngs[seed, hashed] = HashRNG(seed) if hashed else LegacyRNG(seed)
+        return rng
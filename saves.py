@@ -1,12 +1,27 @@
 import os
+import re
+import atexit
 import json
 import random
+import struct
+import zlib
 
 from shutil import rmtree
 from collections import OrderedDict
-
-from terrain import world_gen
-from console import log
+from operator import mul
+from time import time
+from queue import Queue, Empty
+from threading import Thread, Lock
+from concurrent.futures import Future
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from terrain import world_gen, LEGACY_TERRAIN, TERRAIN_VERSION, RegionStore, USE_NUMPY
+from console import log, getenv_b
+from column import Column
 from data import timings
 from player import MAX_PLAYER_HEALTH
 
@@ -14,6 +29,8 @@ from player import MAX_PLAYER_HEALTH
 default_meta = {
     'name': 'Untitled',
     'seed': lambda: hash(random.random()),
+    # Saves from before the terrain version was stored use the legacy generator.
+    'terrain_version': LEGACY_TERRAIN,
     'spawn': 0,
     'tick': timings['tick'],
     'players': {},
@@ -45,13 +62,47 @@ default_player = {
 }
 
 SAVES_DIR = 'saves'
+REGIONS_DIR = 'regions'
+CHUNKS_DIR = 'chunks'
 CHUNK_EXT = '.chunk'
+REGION_EXT = '.region'
 SAVE_LINE_LENGTH = world_gen['height'] + 3 + 1  # + slice_height + newline
 CHUNK_SIZE = world_gen['chunk_size'] * SAVE_LINE_LENGTH
 
+REGION_CHUNKS = 32  # Chunks in each region file
+SECTOR_SIZE = 512
+REGION_MAGIC = b'PYRG'
+REGION_FORMAT = 1
+REGION_HEADER = struct.Struct('<4sH')  # Magic, format version
+REGION_ENTRY = struct.Struct('<II')  # Sector offset and length in bytes of a chunk
+REGION_FILES_OPEN = 16
+
+# Binary chunks: a header, the number of columns, each column's x in the
+#   chunk, slice height and length, then the (block, length) runs of all the
+#   columns, one after another. The body after the header is compressed if
+#   CHUNK_ZLIB is set, which is slower to load, so new chunks are only
+#   compressed with PYCRAFT_COMPRESS_CHUNKS set.
+CHUNK_MAGIC = b'PYCC'
+CHUNK_FORMAT = 1
+CHUNK_HEADER = struct.Struct('<4sBB')  # Magic, format version, flags
+CHUNK_COLUMN = struct.Struct('<BHH')  # x in chunk, slice height, length
+CHUNK_ZLIB = 1  # Flag for a zlib compressed body
+COMPRESS_CHUNKS = getenv_b('PYCRAFT_COMPRESS_CHUNKS')
+
+JOURNAL_COMPACT_RECORDS = 1000  # Journal records before compacting it into meta.json
+JOURNAL_COMPACT_INTERVAL = 60  # Seconds between compacting, which also saves the mobs
+
+SAVE_INTERVAL = 5  # Seconds edited chunks wait to be written
+SAVE_DIRTY_CHUNKS = 32  # Edited chunks which are written without waiting
+
+RUNS = re.compile(rb'(.)\1{0,254}', re.DOTALL)
+BYTES = [bytes((value,)) for value in range(256)]
+
 
 save_path = lambda save, filename='': os.path.join(SAVES_DIR, save, filename)
 meta_path = lambda save: save_path(save, 'meta.json')
+journal_path = lambda save: save_path(save, 'meta.journal')
+region_store = lambda save: RegionStore(save_path(save, REGIONS_DIR))
 chunk_num = lambda x: int(x) // world_gen['chunk_size']
 
 
@@ -60,6 +111,7 @@ def check_map_dir():
 
 
 def new_save(meta):
+    meta.setdefault('terrain_version', TERRAIN_VERSION)
     meta = check_meta(meta)
 
     # Find unique dir name
@@ -82,6 +134,7 @@ def new_save(meta):
 
 
 def delete_save(save):
+    close_region_files(save)
     rmtree(save_path(save))
 
 
@@ -92,58 +145,281 @@ def load_player(name, meta):
     return meta
 
 
+def sectors(length):
+    return -(-length // SECTOR_SIZE)
+
+
+class RegionFile:
+    """
+        REGION_CHUNKS chunks packed into one file.
+
+        The first sector is the format header, and a table of the offset (in
+            sectors) and length of each chunk, followed by the chunks, each
+            taking whole sectors. A chunk is rewritten in place while it fits
+            in its sectors, otherwise it is moved to the first run of free
+            sectors.
+    """
+
+    def __init__(self, path):
+        self._lock = Lock()
+
+        exists = os.path.isfile(path)
+        self._file = open(path, 'r+b' if exists else 'w+b', buffering=0)
+
+        if exists:
+            header = self._file.read(SECTOR_SIZE).ljust(SECTOR_SIZE, b'\0')
+            magic, version = REGION_HEADER.unpack_from(header)
+
+            if magic != REGION_MAGIC:
+                self._file.close()
+                raise ValueError('{} is not a region file'.format(path))
+
+            if version > REGION_FORMAT:
+                self._file.close()
+                raise ValueError('Region file {} has unknown format version {}'.format(path, version))
+
+        else:
+            header = REGION_HEADER.pack(REGION_MAGIC, REGION_FORMAT).ljust(SECTOR_SIZE, b'\0')
+            self._file.write(header)
+
+        entries = [REGION_ENTRY.unpack_from(header, REGION_HEADER.size + i * REGION_ENTRY.size)
+                   for i in range(REGION_CHUNKS)]
+        self._offsets = [offset for offset, _ in entries]
+        self._lengths = [length for _, length in entries]
+
+    def __contains__(self, i):
+        return self._lengths[i] > 0
+
+    def read(self, i):
+        """ Returns the data of the `i`th chunk in the region, or None. """
+
+        with self._lock:
+            if not self._lengths[i]:
+                return None
+
+            self._file.seek(self._offsets[i] * SECTOR_SIZE)
+            return self._file.read(self._lengths[i])
+
+    def write(self, i, data):
+        with self._lock:
+            if not self._lengths[i] or sectors(len(data)) > sectors(self._lengths[i]):
+                self._offsets[i] = self._allocate(i, sectors(len(data)))
+            self._lengths[i] = len(data)
+
+            self._file.seek(self._offsets[i] * SECTOR_SIZE)
+            self._file.write(data)
+
+            # Only point to the chunk once it is written
+            self._file.seek(REGION_HEADER.size + i * REGION_ENTRY.size)
+            self._file.write(REGION_ENTRY.pack(self._offsets[i], self._lengths[i]))
+
+    def _allocate(self, i, n_sectors):
+        """ Returns the first run of n_sectors not used by the other chunks. """
+
+        used = sorted((self._offsets[j], sectors(self._lengths[j]))
+                      for j in range(REGION_CHUNKS) if j != i and self._lengths[j])
+
+        start = 1  # After the header
+        for offset, n_used in used:
+            if offset - start >= n_sectors:
+                break
+            start = max(start, offset + n_used)
+
+        return start
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_region_files = OrderedDict()
+_region_files_lock = Lock()
+def region_file(save, region_n, create=False):
+    """ Returns the (cached) open region file, or None if it doesn't exist
+          and create is False. """
+
+    key = (save, region_n)
+    with _region_files_lock:
+        region = _region_files.get(key)
+
+        if region is not None:
+            _region_files.move_to_end(key)
+
+        else:
+            path = save_path(save, os.path.join(CHUNKS_DIR, str(region_n) + REGION_EXT))
+
+            if not os.path.isfile(path):
+                if not create:
+                    return None
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            region = _region_files[key] = RegionFile(path)
+
+            if len(_region_files) > REGION_FILES_OPEN:
+                _region_files.popitem(last=False)[1].close()
+
+        return region
+
+
+def close_region_files(save):
+    with _region_files_lock:
+        for key in [key for key in _region_files if key[0] == save]:
+            _region_files.pop(key).close()
+
+
 def chunk_file_name(save, chunk_n):
+    """ Chunk files from before region files, which are still read. """
     return save_path(save, str(chunk_n) + CHUNK_EXT)
 
 
-def load_chunk(save, chunk_n):
+def chunk_in_region(save, chunk_n):
+    region = region_file(save, chunk_n // REGION_CHUNKS)
+    return region is not None and chunk_n % REGION_CHUNKS in region
+
+
+def chunk_exists(save, chunk_n):
+    return chunk_in_region(save, chunk_n) or os.path.isfile(chunk_file_name(save, chunk_n))
+
+
+def read_chunk(save, chunk_n):
+    """ Returns the saved data of the chunk, or None. """
+
+    region = region_file(save, chunk_n // REGION_CHUNKS)
+    data = region and region.read(chunk_n % REGION_CHUNKS)
+
+    if data is None:
+        try:
+            with open(chunk_file_name(save, chunk_n), 'rb') as file_:
+                data = file_.read()
+        except IOError:
+            pass
+
+    return data
+
+
+def write_chunk(save, chunk_n, data):
+    region_file(save, chunk_n // REGION_CHUNKS, create=True).write(chunk_n % REGION_CHUNKS, data)
+
+
+def encode_chunk(chunk, slice_heights, compress=COMPRESS_CHUNKS):
+    """ Returns the chunk in the binary format, each column run length encoded. """
+
+    body = bytearray([len(chunk)])
+    runs = bytearray()
+
+    for pos, slice_ in sorted(chunk.items()):
+        slice_ = bytes(slice_)
+        body += CHUNK_COLUMN.pack(int(pos) % world_gen['chunk_size'], int(slice_heights[pos]), len(slice_))
+
+        for run in RUNS.finditer(slice_):
+            runs.append(slice_[run.start()])
+            runs.append(run.end() - run.start())
+
+    body += runs
+
+    flags = CHUNK_ZLIB if compress else 0
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_FORMAT, flags) + (zlib.compress(body) if compress else body)
+
+
+def expand_runs(runs):
+    """ Returns the blocks of the (block, length) runs. """
+
+    if USE_NUMPY:
+        runs = numpy.frombuffer(runs, dtype=numpy.uint8)
+        return numpy.repeat(runs[0::2], runs[1::2]).tobytes()
+    else:
+        return b''.join(map(mul, map(BYTES.__getitem__, runs[0::2]), runs[1::2]))
+
+
+def decode_chunk(data, chunk_n):
+    """ Returns the map and slice heights of a chunk in the binary format. """
+
+    magic, version, flags = CHUNK_HEADER.unpack_from(data)
+    if version > CHUNK_FORMAT:
+        raise ValueError('Chunk {} has unknown format version {}'.format(chunk_n, version))
+
+    body = memoryview(data)[CHUNK_HEADER.size:]
+    if flags & CHUNK_ZLIB:
+        body = memoryview(zlib.decompress(body))
+
+    n_columns = body[0]
+    runs = body[1 + n_columns * CHUNK_COLUMN.size:]
+
+    # Expand the runs of every column at once
+    blocks = expand_runs(runs)
+
     map_ = {}
     slice_heights = {}
     chunk_pos = chunk_n * world_gen['chunk_size']
 
-    try:
-        with open(chunk_file_name(save, chunk_n)) as data:
-            for d_pos, line in enumerate(data):
-                abs_pos = chunk_pos + d_pos
+    start = 0
+    for d_pos, slice_height, length in CHUNK_COLUMN.iter_unpack(body[1:1 + n_columns * CHUNK_COLUMN.size]):
+        map_[chunk_pos + d_pos] = Column(blocks[start:start + length])
+        slice_heights[chunk_pos + d_pos] = slice_height
+        start += length
 
-                # Truncate to correct size
-                slice_ = line[:world_gen['height']]
+    return map_, slice_heights
 
-                height_error = world_gen['height'] - len(slice_)
-                if not height_error == 0:
-                    # Extend slice height
-                    slice_ = (' ' * height_error) + slice_
 
-                map_[abs_pos] = list(slice_)
+def decode_text_chunk(data, chunk_n):
+    """ Returns the map and slice heights of a chunk in the text format,
+          a line of blocks and slice height for each slice. """
 
-                try:
-                    slice_heights[abs_pos] = int(line[world_gen['height']:])
-                except ValueError:
-                    slice_heights[abs_pos] = world_gen['ground_height']
+    map_ = {}
+    slice_heights = {}
+    chunk_pos = chunk_n * world_gen['chunk_size']
 
-    except IOError:
-        pass
+    for d_pos, line in enumerate(data.splitlines(keepends=True)):
+        abs_pos = chunk_pos + d_pos
+
+        # Truncate to correct size
+        slice_ = line[:world_gen['height']]
+
+        height_error = world_gen['height'] - len(slice_)
+        if not height_error == 0:
+            # Extend slice height
+            slice_ = (b' ' * height_error) + slice_
+
+        map_[abs_pos] = Column(slice_)
+
+        try:
+            slice_heights[abs_pos] = int(line[world_gen['height']:])
+        except ValueError:
+            slice_heights[abs_pos] = world_gen['ground_height']
 
     return map_, slice_heights
 
 
-def save_chunk(save, chunk_n, chunk, slice_heights):
-    """ Updates slices within one chunk. """
+def parse_chunk(data, chunk_n):
+    """ Returns the map and slice heights of the chunk, in either format. """
 
-    filename = chunk_file_name(save, chunk_n)
-    if os.path.isfile(filename):
-        mode = 'r+'
+    if data[:len(CHUNK_MAGIC)] == CHUNK_MAGIC:
+        return decode_chunk(data, chunk_n)
     else:
-        mode = 'w'
+        return decode_text_chunk(data, chunk_n)
+
+
+def load_chunk(save, chunk_n):
+    data = read_chunk(save, chunk_n)
+    if data is None:
+        return {}, {}
 
-    with open(filename, mode) as file_:
+    return parse_chunk(data, chunk_n)
+
+
+def save_chunk(save, chunk_n, chunk, slice_heights):
+    """ Updates slices within one chunk. """
 
-        file_.truncate(CHUNK_SIZE)
-        for pos, slice_ in chunk.items():
-            rel_pos = int(pos) % world_gen['chunk_size']
+    # Update the saved chunk with the new slices
+    data = read_chunk(save, chunk_n)
+    if data is not None:
+        saved_chunk, saved_slice_heights = parse_chunk(data, chunk_n)
 
-            file_.seek(int(rel_pos) * SAVE_LINE_LENGTH)
-            file_.write(''.join(slice_) + str(slice_heights[pos])[:3].zfill(3) + '\n')
+        saved_chunk.update(chunk)
+        saved_slice_heights.update({pos: slice_heights[pos] for pos in chunk})
+        chunk, slice_heights = saved_chunk, saved_slice_heights
+
+    write_chunk(save, chunk_n, encode_chunk(chunk, slice_heights))
 
 
 def save_slices(save, new_slices, slice_heights):
@@ -167,6 +443,244 @@ def save_slices(save, new_slices, slice_heights):
         save_chunk(save, chunk_pos, chunk, slice_heights)
 
 
+class ChunkIO:
+    """
+        Reads and writes a save's chunks on one background thread.
+
+        Loads and saves are queued, returning futures of their results.
+            Edited slices are kept as dirty chunks, so repeated edits to a
+            chunk are merged into one write. They are written every
+            SAVE_INTERVAL seconds, or sooner once SAVE_DIRTY_CHUNKS chunks
+            are dirty.
+    """
+
+    def __init__(self, save):
+        self._save = save
+        self._queue = Queue()
+        self._dirty = {}  # {chunk_n: ({x: slice}, {x: slice_height})}
+        self._lock = Lock()  # Guards _dirty
+        self._flush_queued = False
+        self._last_flush = time()
+        self._stopping = False
+
+        self._thread = Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def _submit(self, func, *args):
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def load_chunk(self, chunk_n):
+        """ Returns a future of the chunk's map and slice heights, including
+              its unwritten edits. """
+        return self._submit(self._load, chunk_n)
+
+    def save_chunk(self, chunk_n, chunk, slice_heights):
+        # Copy the slices, as they can be changed before they are written.
+        chunk = {pos: bytes(slice_) for pos, slice_ in chunk.items()}
+        return self._submit(save_chunk, self._save, chunk_n, chunk, slice_heights)
+
+    def save_slices(self, new_slices, slice_heights):
+        """ Marks the slices to be saved. """
+
+        with self._lock:
+            for pos, slice_ in new_slices.items():
+                chunk, chunk_slice_heights = self._dirty.setdefault(chunk_num(pos), ({}, {}))
+                chunk[pos] = slice_
+                chunk_slice_heights[pos] = slice_heights[pos]
+
+            flush = len(self._dirty) >= SAVE_DIRTY_CHUNKS and not self._flush_queued
+            self._flush_queued |= flush
+
+        if flush:
+            self._submit(self._flush)
+
+    def flush(self):
+        """ Queues writing every dirty chunk, returning its future. """
+        return self._submit(self._flush)
+
+    def _load(self, chunk_n):
+        self._write(self._take([chunk_n]))
+        return load_chunk(self._save, chunk_n)
+
+    def _take(self, chunk_ns=None):
+        """ Removes and returns the dirty chunks, copying the slices as they
+              are now, as they keep being changed by the game. """
+
+        with self._lock:
+            if chunk_ns is None:
+                dirty, self._dirty = self._dirty, {}
+                self._flush_queued = False
+            else:
+                dirty = {chunk_n: self._dirty.pop(chunk_n) for chunk_n in chunk_ns if chunk_n in self._dirty}
+
+            return {chunk_n: ({pos: bytes(slice_) for pos, slice_ in chunk.items()}, chunk_slice_heights)
+                    for chunk_n, (chunk, chunk_slice_heights) in dirty.items()}
+
+    def _write(self, dirty):
+        written = set()
+        try:
+            for chunk_n, (chunk, chunk_slice_heights) in dirty.items():
+                save_chunk(self._save, chunk_n, chunk, chunk_slice_heights)
+                written.add(chunk_n)
+        except Exception:
+            self._restore({chunk_n: chunk for chunk_n, chunk in dirty.items() if chunk_n not in written})
+            raise
+
+        if dirty:
+            log('saved chunks', dirty.keys())
+
+    def _restore(self, dirty):
+        """ Marks chunks which failed to be written as dirty again, under
+              any edits made since they were taken. """
+
+        with self._lock:
+            for chunk_n, (chunk, chunk_slice_heights) in dirty.items():
+                newer, newer_slice_heights = self._dirty.setdefault(chunk_n, ({}, {}))
+                for pos, slice_ in chunk.items():
+                    if pos not in newer:
+                        newer[pos] = slice_
+                        newer_slice_heights[pos] = chunk_slice_heights[pos]
+
+    def _flush(self):
+        try:
+            self._write(self._take())
+        finally:
+            self._last_flush = time()
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=max(0, self._last_flush + SAVE_INTERVAL - time()))
+            except Empty:
+                job = None
+
+            if job is not None:
+                future, func, args = job
+                if func is None:
+                    break
+
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args))
+                    except Exception as e:
+                        log('Chunk I/O error', e)
+                        future.set_exception(e)
+
+            if time() - self._last_flush >= SAVE_INTERVAL:
+                try:
+                    self._flush()
+                except Exception as e:
+                    # The chunks are still dirty, so they are tried again
+                    log('Chunk I/O error', e)
+
+    def close(self):
+        """ Writes the remaining chunks and stops the thread, raising any
+              error from writing them. """
+
+        if not self._stopping:
+            self._stopping = True
+            atexit.unregister(self.close)
+            flushed = self.flush()
+            self._queue.put((None, None, None))
+            self._thread.join()
+            flushed.result()
+
+
+class MetaJournal:
+    """
+        Saves changes to a save's meta as an append-only journal, instead
+            of rewriting all of meta.json for every change.
+
+        Each record is a line of JSON [section, key, value], setting
+            meta[section][key] to value, or removing it if value is null.
+            The journal is compacted by writing the whole meta to meta.json,
+            after JOURNAL_COMPACT_RECORDS records or JOURNAL_COMPACT_INTERVAL
+            seconds, and when it's closed.
+
+        Players and items are journalled. Mobs move every tick, so they are
+            only saved when the journal is compacted, and the mobs since
+            then are lost if the game crashes. They are respawned anyway.
+    """
+
+    def __init__(self, save, meta):
+        self._save = save
+        self._meta = meta
+        self._lock = Lock()
+
+        self._file = open(journal_path(save), 'a')
+        self._records = 0
+        self._last_compact = time()
+
+        atexit.register(self.close)
+
+    def record(self, section, key, value):
+        with self._lock:
+            if self._file.closed:
+                return
+
+            self._file.write(json.dumps([section, key, value]) + '\n')
+            self._file.flush()
+            self._records += 1
+
+            if self._records >= JOURNAL_COMPACT_RECORDS:
+                self._compact()
+
+    def remove(self, section, key):
+        self.record(section, key, None)
+
+    def update(self):
+        """ Compacts the journal if it is due. """
+
+        if time() - self._last_compact >= JOURNAL_COMPACT_INTERVAL:
+            with self._lock:
+                if not self._file.closed:
+                    self._compact()
+
+    def _compact(self):
+        # The journal is only cleared once meta.json is replaced, replaying
+        #   it over the new meta.json sets the same values again.
+        save_meta(self._save, self._meta)
+
+        self._file.seek(0)
+        self._file.truncate()
+        self._records = 0
+        self._last_compact = time()
+
+    def close(self):
+        atexit.unregister(self.close)
+
+        with self._lock:
+            if not self._file.closed:
+                self._compact()
+                self._file.close()
+
+
+def replay_journal(save, meta):
+    """ Applies the meta journal's records to the meta. """
+
+    try:
+        with open(journal_path(save)) as f:
+            for line in f:
+                try:
+                    section, key, value = json.loads(line)
+                except ValueError:
+                    # The last record might not have been completely written
+                    continue
+
+                if value is None:
+                    meta[section].pop(key, None)
+                else:
+                    meta[section][key] = value
+    except IOError:
+        pass
+
+    return meta
+
+
 def set_blocks(map_, blocks):
     new_slices = {}
 
@@ -222,12 +736,15 @@ def get_settings():
 
 
 def get_meta(save):
-    return load_meta(meta_path(save), default_meta)
+    return replay_journal(save, load_meta(meta_path(save), default_meta))
 
 
 def save_json(path, meta):
-    with open(path, 'w') as f:
+    # Replace the file in one go, so it is never partly written.
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
         json.dump(meta, f)
+    os.replace(temp_path, path)
 
 
 def load_meta(path, default):
@@ -1,29 +1,36 @@
+from collections import deque
 from time import time
 from math import radians, floor, ceil
-from threading import Thread
+from threading import Thread, Condition, Lock
 
-import terrain, saves, network, mobs, items, render_interface
+import terrain, saves, network, protocol, mobs, items, render_interface
 
 from colours import colour_str, TERM_YELLOW
-from console import log
+from column import empty_column
+from console import log, log_enabled
 from data import timings
 from player import MAX_PLAYER_HEALTH
 
 
+chunk_size = terrain.world_gen['chunk_size']
+
+
 def _log_event(event, args):
-    log('  Event:', colour_str(event, fg=TERM_YELLOW))
+    log('  Event:', lambda: colour_str(event, fg=TERM_YELLOW))
     log('  Args:', args)
     log()
 
 
 def log_event_send(*args, label=None):
-    log('Sending', '- [{}]'.format(label) if label else None)
-    _log_event(*args)
+    if log_enabled():
+        log('Sending', '- [{}]'.format(label) if label else None)
+        _log_event(*args)
 
 
 def log_event_receive(*args, label=''):
-    log('Received', '- [{}]'.format(label) if label else None)
-    _log_event(*args)
+    if log_enabled():
+        log('Received', '- [{}]'.format(label) if label else None)
+        _log_event(*args)
 
 
 def dt(last_tick):
@@ -53,9 +60,7 @@ class Server:
     def _update_clients(self, message, exclude=None):
         log_event_send(message['event'], message['args'], label='Server')
 
-        for name, sock in self.current_players.items():
-            if name != exclude:
-                network.send(sock, message)
+        network.broadcast([sock for name, sock in self.current_players.items() if name != exclude], message)
 
         if self.local_player != exclude:
             self.local_interface.handle(message)
@@ -78,7 +83,7 @@ class Server:
              'splash_damage': self.event_splash_damage,
              'respawn': self.event_respawn,
              'logout': lambda: self.event_logout(sock),
-             'login': lambda name: self.event_login(name, sock),
+             'login': lambda name: self.event_login(name, sock, data.get('protocol', protocol.JSON_PROTOCOL)),
              'unload_slices': self.event_unload_slices
              }[data['event']](*data.get('args', []))
         )
@@ -89,7 +94,7 @@ class Server:
 
     # Handler and local interface mathods
 
-    def event_login(self, name, sock):
+    def event_login(self, name, sock, version=protocol.JSON_PROTOCOL):
         if name not in self.current_players.keys() and not name == self.local_player:
             log('Logging in: ' + name)
 
@@ -97,7 +102,15 @@ class Server:
                 # local_player already contains the local_player name
                 self.current_players[name] = sock
 
+            # Clients from before the binary protocol don't ask for it
+            version = min(version, protocol.PROTOCOL_VERSION)
+            if version > protocol.JSON_PROTOCOL:
+                network.set_protocol(sock, version)
+
             self._update_clients({'event': 'set_players', 'args': [{name: self.game.get_player(name)}]})
+
+            if version > protocol.JSON_PROTOCOL:
+                return {'event': 'set_protocol', 'args': [version]}
         else:
             log('Not Logging in: ' + name)
             return {'event': 'error', 'args': [{'event': 'login', 'message': 'Username in use'}]}
@@ -113,6 +126,7 @@ class Server:
                 players[name] = sock
 
         self.current_players = players
+        self.game.save()
 
     def event_set_blocks(self, blocks):
         self._update_clients({'event': 'set_blocks', 'args': [self.game.set_blocks(blocks)]})
@@ -145,11 +159,11 @@ class Server:
     def event_respawn(self, name):
         player = self.game.get_player(name)
 
-        self.game._meta['items'].update(
-            items.new_item(player['x'], player['y'], player['inv'], self.game._last_tick, ttl=5*60))
+        self.game.add_items(items.new_item(player['x'], player['y'], player['inv'], self.game._last_tick, ttl=5*60))
         player['inv'] = []
         player['x'], player['y'] = self.game.spawn
         player['health'] = MAX_PLAYER_HEALTH
+        self.game.set_player(name, player)
 
         self._update_clients({'event': 'set_players', 'args': [{name: player}]})
 
@@ -187,6 +201,9 @@ class Server:
         self._stop_server()
         self.port, self._stop_server = None, None
 
+    def local_interface_logout(self):
+        self.game.close()
+
     def local_interface_pause(self, paused):
         if not self.serving:
             self.game.pause(paused)
@@ -223,6 +240,100 @@ class Server:
     def local_interface_items(self):
         return self.game.items
 
+    def local_interface_request_chunks(self, chunk_list, needed):
+        self.game.request_chunks(chunk_list, needed)
+
+    def local_interface_cancel_chunks(self, chunk_list):
+        self.game.cancel_chunks(chunk_list)
+
+    def local_interface_merge_chunks(self):
+        """ Returns the chunks which failed to load. """
+
+        new_chunks, blocks, failed = self.game.merge_chunks()
+
+        if new_chunks is not None:
+            self.local_interface.handle({'event': 'set_chunks', 'args': list(new_chunks)})
+        if blocks:
+            self._update_clients({'event': 'set_blocks', 'args': [blocks]})
+
+        return failed
+
+    def local_interface_chunk_loaded(self, x):
+        return self.game.chunk_loaded(x)
+
+
+class ChunkLoader:
+    """
+        Loads chunks on a background thread, generating them if they haven't
+            been saved yet.
+
+        Requests are handled in order, and can be cancelled until they start.
+            Chunks which fail to load are finished without a chunk.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._requests = deque()
+        self._finished = deque()
+        self._condition = Condition()
+        self._stopping = False
+
+        self._thread = Thread(target=self._loader, daemon=True)
+        self._thread.start()
+
+    def request(self, chunk_list):
+        with self._condition:
+            self._requests.extend(chunk_n for chunk_n in chunk_list if chunk_n not in self._requests)
+            self._condition.notify()
+
+    def cancel(self, chunk_list):
+        """ Returns the chunks which were cancelled before they started loading. """
+
+        cancelled = []
+        with self._condition:
+            for chunk_n in chunk_list:
+                try:
+                    self._requests.remove(chunk_n)
+                except ValueError:
+                    pass
+                else:
+                    cancelled.append(chunk_n)
+
+        return cancelled
+
+    def finished(self):
+        """ Returns the (chunk_n, chunk, slice_heights) of each chunk loaded
+              since the last call, with a chunk of None if it failed. """
+
+        finished = []
+        while self._finished:
+            finished.append(self._finished.popleft())
+        return finished
+
+    def stop(self):
+        """ Stops the thread, after the chunk being loaded. """
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+        self._thread.join()
+
+    def _loader(self):
+        while True:
+            with self._condition:
+                while not self._requests and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    break
+                chunk_n = self._requests.popleft()
+
+            try:
+                self._finished.append((chunk_n,) + self._load(chunk_n))
+            except Exception as e:
+                log('Cannot load chunk', chunk_n, repr(e))
+                self._finished.append((chunk_n, None, None))
+
 
 class Game:
     """ The game. """
@@ -235,37 +346,150 @@ class Game:
         self._last_tick = time()
         self._settings = settings
 
+        terrain.init_features(saves.region_store(save))
+        self._io = saves.ChunkIO(save)
+        self._journal = saves.MetaJournal(save, self._meta)
+
+        # Chunks requested from the loader, which have empty slices in the map until they are merged
+        self._pending = set()
+        # Edits to the slices of pending chunks, made when they are merged
+        self._waiting_blocks = {}  # {x: {y: block}}
+        self._gen_lock = Lock()
+        self._loader = ChunkLoader(self._load_chunk)
+
+    def _load_chunk(self, chunk_n, loading=None):
+        """ Returns the chunk from the future `loading` (or a new load),
+              generating it if it hasn't been saved. """
+
+        chunk, chunk_slice_heights = (loading or self._io.load_chunk(chunk_n)).result()
+
+        if not chunk:
+            # Terrain generation isn't safe to use from more than one thread.
+            with self._gen_lock:
+                chunk, chunk_slice_heights = terrain.gen_chunk(chunk_n, self._meta)
+            self._io.save_chunk(chunk_n, chunk, chunk_slice_heights)
+
+        return chunk, chunk_slice_heights
+
+    def _add_chunks(self, new_slices, new_slice_heights):
+        log('new slices', new_slices.keys())
+
+        self._map.update(new_slices)
+        self._slice_heights.update(new_slice_heights)
+        return new_slices, new_slice_heights
+
     def get_chunks(self, chunk_list):
         new_slices = {}
         new_slice_heights = {}
 
         log('loading chunks', chunk_list)
 
-        # Generates new terrain
-        for chunk_n in chunk_list:
+        # Queue every load before waiting for any of them
+        loading = [(chunk_n, self._io.load_chunk(chunk_n)) for chunk_n in chunk_list]
 
-            chunk, chunk_slice_heights = saves.load_chunk(self._save, chunk_n)
-            if not chunk:
-                chunk, chunk_slice_heights = terrain.gen_chunk(chunk_n, self._meta)
-                saves.save_chunk(self._save, chunk_n, chunk, chunk_slice_heights)
+        for chunk_n, future in loading:
+            chunk, chunk_slice_heights = self._load_chunk(chunk_n, future)
 
             new_slices.update(chunk)
             new_slice_heights.update(chunk_slice_heights)
 
-        log('new slices', new_slices.keys())
+        return self._add_chunks(new_slices, new_slice_heights)
 
-        self._map.update(new_slices)
-        self._slice_heights.update(new_slice_heights)
-        return {key: ''.join(value) for key, value in new_slices.items()}, new_slice_heights
+    def request_chunks(self, chunk_list, needed):
+        """ Starts loading the chunks in the background. The slices of the
+              needed chunks are empty until the chunks are merged. """
+
+        log('requesting chunks', chunk_list)
+
+        self._pending.update(chunk_list)
+        self._loader.request(chunk_list)
+
+        for chunk_n in needed:
+            for x in range(chunk_n * chunk_size, (chunk_n + 1) * chunk_size):
+                if x not in self._map:
+                    self._map[x] = empty_column()
+                    self._slice_heights[x] = terrain.world_gen['ground_height']
+
+    def _remove_empty_slices(self, chunk_n):
+        """ Removes the pending chunk's empty slices, so it's requested again
+              if it's needed. """
+
+        for x in range(chunk_n * chunk_size, (chunk_n + 1) * chunk_size):
+            self._map.pop(x, None)
+            self._slice_heights.pop(x, None)
+
+    def cancel_chunks(self, chunk_list):
+        for chunk_n in self._loader.cancel(chunk_list):
+            self._pending.discard(chunk_n)
+            self._remove_empty_slices(chunk_n)
+
+    def merge_chunks(self):
+        """
+            Adds the chunks loaded in the background to the map, then makes
+                the edits which were waiting for them.
+
+            Returns the chunks like get_chunks (or None if there are none),
+                the edits made, and the chunks which failed to load.
+        """
+
+        new_slices = {}
+        new_slice_heights = {}
+        failed = []
+
+        for chunk_n, chunk, chunk_slice_heights in self._loader.finished():
+            self._pending.discard(chunk_n)
+
+            if chunk is None:
+                failed.append(chunk_n)
+                self._remove_empty_slices(chunk_n)
+            else:
+                new_slices.update(chunk)
+                new_slice_heights.update(chunk_slice_heights)
+
+        if not new_slices:
+            return None, {}, failed
+
+        new_chunks = self._add_chunks(new_slices, new_slice_heights)
+        blocks = self.set_blocks({x: self._waiting_blocks.pop(x) for x in list(self._waiting_blocks)
+                                  if x in new_slices})
+
+        return new_chunks, blocks, failed
+
+    def chunk_loaded(self, x):
+        return x // chunk_size not in self._pending
 
     def set_blocks(self, blocks):
+        """ Returns the edits made. Edits to pending chunks are made when
+              the chunks are merged, as their slices are placeholders. """
+
+        for x, col in blocks.items():
+            if not self.chunk_loaded(int(x)):
+                self._waiting_blocks.setdefault(int(x), {}).update(col)
+
+        blocks = {x: col for x, col in blocks.items() if self.chunk_loaded(int(x))}
+
         self._map, new_slices = saves.set_blocks(self._map, blocks)
-        saves.save_slices(self._save, new_slices, self._slice_heights)
+        self._io.save_slices(new_slices, self._slice_heights)
         return blocks
 
+    def save(self):
+        """ Writes the edited chunks without waiting for the interval. """
+        self._io.flush()
+
+    def close(self):
+        self._loader.stop()
+
+        with self._gen_lock:
+            terrain.flush_regions()
+
+        try:
+            self._io.close()
+        finally:
+            self._journal.close()
+
     def set_player(self, name, player):
         self._meta['players'][name].update(player)
-        saves.save_meta(self._save, self._meta)
+        self._journal.record('players', name, self._meta['players'][name])
 
     def get_player(self, name):
         self._meta = saves.load_player(name, self._meta)
@@ -283,6 +507,8 @@ class Game:
         self._dt, self._last_tick = dt(self._last_tick)
         self.time += self._dt
 
+        self._journal.update()
+
         return self._dt, self.time
 
     def reload_slices(self):
@@ -304,7 +530,7 @@ class Game:
             return {}, {}
 
         updated_players, new_items = mobs.update(self._meta['mobs'], self._meta['players'], self._map, self._last_tick)
-        self._meta['items'].update(new_items)
+        self.add_items(new_items)
         return updated_players, new_items
 
     def spawn_mobs(self, n_mob_spawn_cycles, bk_objects, sky_colour, day, lights):
@@ -328,8 +554,18 @@ class Game:
     def update_items(self):
         removed_items = items.pickup_items(self._meta['items'], self._meta['players'])
         removed_items += items.despawn_items(self._meta['items'], self._last_tick)
+
+        for id_ in removed_items:
+            self._journal.remove('items', id_)
+
         return removed_items
 
+    def add_items(self, new_items):
+        self._meta['items'].update(new_items)
+
+        for id_, item in new_items.items():
+            self._journal.record('items', id_, item)
+
     @property
     def mobs(self):
         return self._meta['mobs']
@@ -3,11 +3,12 @@ from math import radians, floor, ceil
 from time import time
 
 from server import Server, log_event_send, log_event_receive, dt
+from column import Column, empty_column
 from console import log
 from data import timings
 from player import MAX_PLAYER_HEALTH
 
-import saves, terrain, network, mobs
+import saves, terrain, network, protocol, mobs, prefetch
 
 chunk_size = terrain.world_gen['chunk_size']
 
@@ -28,6 +29,7 @@ class RemoteInterface:
         self.game = True
         self.error = None
         self._name = name
+        self.gravity = terrain.GravityTracker()
 
         # We cannot serve, we are connected to a server.
         # TODO: Maybe we can do this better...?
@@ -47,22 +49,22 @@ class RemoteInterface:
         self._listener_t.daemon = True
         self._listener_t.start()
 
-        # Login
-        self._send('login', [self._name])
+        # Login, asking for the binary protocol
+        self._send('login', [self._name], protocol=protocol.PROTOCOL_VERSION)
 
         # Server doesn't respond
         if not self.finished_login.wait(3):
             self.error = 'No response from server on login'
             log(self.error)
 
-            self._sock.close()
+            network.close(self._sock)
             return
 
         # Server responds with error
         if self.error is not None:
             log('Error response from server on login:', self.error)
 
-            self._sock.close()
+            network.close(self._sock)
             return
 
         # Login successful!
@@ -71,7 +73,7 @@ class RemoteInterface:
         self._dt = False
         self._last_tick = time()
 
-        self._chunks_requested = set()
+        self._prefetcher = prefetch.ChunkPrefetcher()
 
         self._send('get_players')
         self._send('get_mobs')
@@ -81,10 +83,10 @@ class RemoteInterface:
         self.redraw = False
         self.view_change = False
 
-    def _send(self, event, args=[]):
+    def _send(self, event, args=[], **fields):
         log_event_send(event, args, label='RemoteInterface')
 
-        network.send(self._sock, {'event': event, 'args': args})
+        network.send(self._sock, dict(fields, event=event, args=args))
 
     def _listener(self):
         while True:
@@ -104,6 +106,7 @@ class RemoteInterface:
              'add_items': self._event_add_items,
              'remove_items': self._event_remove_items,
              'set_time': self._event_set_time,
+             'set_protocol': self._event_set_protocol,
              'logout': self._event_logout,
              'error': self._event_error
              }[data['event']](*data.get('args', []))
@@ -115,13 +118,15 @@ class RemoteInterface:
 
     def _event_set_blocks(self, blocks):
         self.map_, _ = saves.set_blocks(self.map_, blocks)
+        self.gravity.touch(blocks)
         self.view_change = True
 
     def _event_set_chunks(self, new_chunks, new_slice_heights):
-        self.map_.update({int(key): list(value) for key, value in new_chunks.items()})
+        self.map_.update({int(key): Column(value) for key, value in new_chunks.items()})
         self.slice_heights.update({int(key): value for key, value in new_slice_heights.items()})
 
-        self._chunks_requested.difference_update(terrain.get_chunk_list(new_chunks.keys()))
+        self._prefetcher.received(terrain.get_chunk_list(new_chunks.keys()))
+        self.gravity.invalidate()
         self.view_change = True
 
     def _event_set_players(self, players):
@@ -156,16 +161,16 @@ class RemoteInterface:
     def _event_set_time(self, time):
         self.time = time
 
+    def _event_set_protocol(self, version):
+        network.set_protocol(self._sock, version)
+
     def _event_logout(self, error=None):
         self.game = False
 
         if error is not None:
             self.error = error
 
-        try:
-            self._sock.close()
-        except OSError:
-            pass
+        network.close(self._sock)
 
     def _event_error(self, error):
         self.finished_login.set()
@@ -176,19 +181,39 @@ class RemoteInterface:
 
     # Main loop methods:
 
-    def get_chunks(self, chunk_list):
-        slices_its_loading = [(chunk_num + chunk * chunk_size) for chunk in chunk_list for chunk_num in range(chunk_size)]
+    def get_chunks(self, chunk_list, x, edges):
+        """ Requests the chunks the view needs, and the chunks the player is
+              moving towards. Returns the chunks requested. """
 
-        self.map_.update({i: list(terrain.EMPTY_SLICE) for i in slices_its_loading})
-        self.slice_heights.update({i: terrain.world_gen['ground_height'] for i in slices_its_loading})
-        self._send('get_chunks', [chunk_list])
-        self._chunks_requested.update(chunk_list)
-        self.view_change = True
+        self._prefetcher.move(x)
+        request, cancel = self._prefetcher.schedule(chunk_list, edges, self._chunk_in_map)
+
+        # Show empty slices until the chunks the view needs arrive.
+        #   (The chunks might have just arrived, if they were fetched ahead.)
+        for i in (chunk_num + chunk * chunk_size for chunk in chunk_list for chunk_num in range(chunk_size)):
+            self.map_.setdefault(i, empty_column())
+            self.slice_heights.setdefault(i, terrain.world_gen['ground_height'])
+
+        if cancel:
+            # The server has already been asked, so their responses are just ignored.
+            log('cancelled chunks', cancel)
+
+        if request:
+            self._send('get_chunks', [request])
+
+        if chunk_list:
+            self.view_change = True
+
+        return request
+
+    def _chunk_in_map(self, chunk):
+        return chunk * chunk_size in self.map_
 
     def chunk_loaded(self, x):
-        return (x // terrain.world_gen['chunk_size']) not in self._chunks_requested
+        return (x // terrain.world_gen['chunk_size']) not in self._prefetcher.in_flight
 
     def unload_slices(self, edges):
+        edges = self._prefetcher.keep_edges(edges)
         edges = [chunk_size * floor(edges[0] / chunk_size),
                  chunk_size * ceil(edges[1] / chunk_size)]
         self.map_ = {x: s for x, s in self.map_.items() if x in range(*edges)}
@@ -280,6 +305,8 @@ class LocalInterface:
         self.time = timings['tick']
         self._name = name
         self.current_players = {}
+        self.gravity = terrain.GravityTracker()
+        self._prefetcher = prefetch.ChunkPrefetcher()
         self._server = Server(name, save, port, settings, self)
         self._server.local_interface_login()
 
@@ -290,8 +317,8 @@ class LocalInterface:
     def handle(self, data):
         log_event_receive(data['event'], data['args'], label='LocalInterface')
 
-        {'set_blocks': self._event_view_change,
-         'set_chunks': self._event_view_change,
+        {'set_blocks': self._event_set_blocks,
+         'set_chunks': self._event_set_chunks,
          'set_players': self._event_set_players,
          'remove_player': self._event_remove_player,
          'set_mobs': self._event_set_mobs,
@@ -305,7 +332,13 @@ class LocalInterface:
 
     # Handler network request methods:
 
-    def _event_view_change(self, *args):
+    def _event_set_blocks(self, blocks):
+        self.gravity.touch(blocks)
+        self.view_change = True
+
+    def _event_set_chunks(self, new_chunks, new_slice_heights):
+        self._prefetcher.received(terrain.get_chunk_list(new_chunks.keys()))
+        self.gravity.invalidate()
         self.view_change = True
 
     def _event_set_players(self, players):
@@ -343,16 +376,32 @@ class LocalInterface:
 
     # Main loop methods:
 
-    def get_chunks(self, chunk_list):
-        slices_its_loading = ((chunk_num + chunk * chunk_size) for chunk in chunk_list for chunk_num in range(chunk_size))
+    def get_chunks(self, chunk_list, x, edges):
+        """ Starts loading the chunks the view needs, and the chunks the
+              player is moving towards, and merges any chunks which have
+              loaded since the last frame. Returns the chunks requested. """
 
-        self.handle(self._send('get_chunks', [chunk_list]))
-        self.view_change = True
+        # Chunks which failed to load are requested again, if they're still needed
+        failed = self._server.local_interface_merge_chunks()
+        self._prefetcher.received(failed)
+
+        self._prefetcher.move(x)
+        request, cancel = self._prefetcher.schedule(chunk_list, edges, lambda chunk: chunk * chunk_size in self.map_)
+
+        if cancel:
+            self._server.local_interface_cancel_chunks(cancel)
+
+        if request or chunk_list:
+            self._server.local_interface_request_chunks(request, chunk_list)
+            self.view_change = True
+
+        return request
 
     def chunk_loaded(self, x):
-        return True
+        return self._server.local_interface_chunk_loaded(x)
 
     def unload_slices(self, edges):
+        edges = self._prefetcher.keep_edges(edges)
         edges = [chunk_size * floor(edges[0] / chunk_size),
                  chunk_size * ceil(edges[1] / chunk_size)]
         self._send('unload_slices', [self._name, edges])
@@ -363,6 +412,7 @@ class LocalInterface:
     def logout(self):
         if self.serving:
             self.kill_server()
+        self._server.local_interface_logout()
         self._event_logout()
 
     def init_server(self):
@@ -1,23 +1,75 @@
-import random
+import json
+import os
+import tempfile
+import zlib
+
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
 from math import ceil, cos, sin, radians, atan2
+from threading import Lock
 
 from data import world_gen, blocks
-from console import log, DEBUG
+from console import log, DEBUG, getenv_b
+from rng import feature_rng, AliasTable
+
+import grid
+
+from column import Column
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Use the NumPy generation path when it is available, unless disabled.
+USE_NUMPY = numpy is not None and not getenv_b('PYCRAFT_NO_NUMPY')
 
 
 # Maximum width of half a tree
-MAX_HALF_TREE = int(len(max(world_gen['trees'], key=lambda tree: len(tree))) / 2)
+MAX_HALF_TREE = int(max(len(tree['leaves']) for tree in world_gen['trees']) / 2)
 
 largest_ore = max(map(lambda ore: world_gen['ores'][ore]['vain_size'], world_gen['ores']))
 MAX_ORE_RANGE = (int((largest_ore - 1) / 2), (int(largest_ore / 2) + 1))
 
-EMPTY_SLICE = [' ' for y in range(world_gen['height'])]
-
 get_chunk_list = lambda slice_list: list(set(int(i) // world_gen['chunk_size'] for i in slice_list))
 
 MAX_HILL_RAD = world_gen['max_hill'] * world_gen['min_grad']
 
+CAVE_Y_RES = 2  # Double the y resolution of the CA to correct for aspect ratio
+CAVE_ITERATIONS = 6
+
+REGION_SIZE = 256  # Slices
+REGION_CACHE_SIZE = 16  # Regions
+
+ORE_FEATURES = OrderedDict((name + '_ore_root', ore) for name, ore in world_gen['ores'].items())
+
+# How far either side of its x each type of feature can change slices.
+FEATURE_REACH = OrderedDict([
+    ('hill', (MAX_HILL_RAD, MAX_HILL_RAD)),
+    ('biome', (world_gen['max_biome'], world_gen['max_biome'])),
+    ('tree', (MAX_HALF_TREE, MAX_HALF_TREE + 1)),
+    ('grass', (0, 1))
+] + [
+    (feature_name, MAX_ORE_RANGE) for feature_name in ORE_FEATURES
+])
+
+# Terrain generator versions. Each save stores the version it was created
+#   with, so existing worlds keep generating the same terrain.
+LEGACY_TERRAIN = 0  # Mersenne Twister reseeded for every feature check
+HASH_TERRAIN = 1  # Stateless hash RNG, see rng.py
+ALIAS_TERRAIN = 2  # Biomes and trees drawn from alias tables
+TERRAIN_VERSION = ALIAS_TERRAIN
+
+# The weighted choices, for ALIAS_TERRAIN
+BIOME_TABLE = AliasTable(world_gen['biomes'], [biome['chance'] for biome in world_gen['biomes'].values()])
+TREE_TABLE = AliasTable(range(len(world_gen['trees'])), [tree['chance'] for tree in world_gen['trees']])
+TREE_CHANCE = sum(tree['chance'] for tree in world_gen['trees']) / len(world_gen['trees'])
+
+# Older versions choose from every biome repeated by its chance
+LEGACY_BIOMES = sorted(name for name, data in world_gen['biomes'].items()
+                       for _ in range(int(data['chance'] * 100)))
+
 
 def move_map(map_, edges):
     # Create subset of slices from map_ between edges
@@ -37,53 +89,186 @@ def detect_edges(map_, edges):
 
 
 def apply_gravity(map_, edges):
-    start_pos = (sum(edges) / 2,
-                 world_gen['height'] - 1)
-
-    new_blocks = {}
-    connected_to_ground = explore_map(map_, edges, start_pos, set())
-
-    for x, slice_ in map_.items():
-        if x not in range(*edges):
-            continue
-        for y in range(len(slice_)-3, -1, -1):
-            block = slice_[y]
-            if (is_solid(block) and (x, y) not in connected_to_ground):
+    """ Returns the blocks to set to move every block which isn't connected
+          to the ground down one. """
+    return GravityTracker().apply(map_, edges)
+
+
+def explore_map(map_, edges, start_pos):
+    """ Returns the grid of blocks connected to start_pos through solid
+          blocks, or through the columns either side of the edges. """
+
+    ground = grid.column_masks(map_, grid.SOLID, *edges)
+    ground[edges[0] - 1] = ground[edges[1]] = grid.FULL_COLUMN
+
+    return grid.flood_fill(ground, grid.from_cells([start_pos]))
+
+
+# Searching downwards first finds the ground soonest.
+NEIGHBOURS_DOWN_LAST = tuple((dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy)
+
+
+class GravityTracker:
+    """
+        Finds the blocks which aren't connected to the ground, keeping them
+            between frames so only the blocks changed since the last frame
+            have to be rechecked.
+
+        The columns either side of the edges count as the ground, as does
+            the bottom row once it is all solid (bedrock).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._dirty = set()
+
+        self._map = None
+        self._edges = None
+        self._floating = set()
+
+    def touch(self, blocks):
+        """ Marks the blocks in a set_blocks dict to be rechecked. """
+
+        with self._lock:
+            self._dirty.update((int(x), int(y)) for x, col in blocks.items() for y in col)
+
+    def invalidate(self):
+        """ Makes the next frame recheck every block, e.g. after new slices are loaded. """
+        self._map = None
+
+    def apply(self, map_, edges):
+        """ Returns the blocks to set to move every block which isn't
+              connected to the ground down one. """
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+        edges = tuple(edges)
+
+        if self._can_update(map_, edges):
+            if edges != self._edges:
+                dirty |= self._move_edges(edges)
+            self._recheck(map_, edges, dirty)
+        else:
+            self._recompute(map_, edges)
+
+        self._map = map_
+        self._edges = edges
+
+        new_blocks = {}
+        for x, y in sorted(self._floating, key=lambda pos: (pos[0], -pos[1])):
+            slice_ = map_[x]
+            if y <= len(slice_) - 3:
                 new_blocks.setdefault(x, {})
                 new_blocks[x][y] = ' '
-                new_blocks[x][y+1] = block
+                new_blocks[x][y+1] = slice_[y]
+
+        return new_blocks
+
+    def _can_update(self, map_, edges):
+        """ The floating blocks can be updated if the map and width of the
+              view are the same, and the bottom row is solid. """
+
+        if map_ is not self._map or self._edges is None:
+            return False
 
-    return new_blocks
+        width = edges[1] - edges[0]
+        if width != self._edges[1] - self._edges[0] or abs(edges[0] - self._edges[0]) >= width:
+            return False
 
+        bottom = world_gen['height'] - 1
+        return all(x in map_ and is_solid(map_[x][bottom]) for x in range(*edges))
 
-def explore_map(map_, edges, start_pos, connected_to_ground):
-    blocks_to_explore = set([start_pos])
-    visted_blocks = set()
+    def _recompute(self, map_, edges):
+        start_pos = (sum(edges) // 2, world_gen['height'] - 1)
+        connected_to_ground = explore_map(map_, edges, start_pos)
 
-    while blocks_to_explore:
-        current_pos = blocks_to_explore.pop()
-        visted_blocks.add(current_pos)
+        solid = grid.column_masks(map_, grid.SOLID, *edges)
+        self._floating = set(grid.cells(grid.subtract(solid, connected_to_ground)))
 
-        if (current_pos[1] >= 0 and current_pos[1] < world_gen['height'] and
-                current_pos not in connected_to_ground and
-                current_pos[0] in range(edges[0]-1, edges[1]+1)):
+    def _move_edges(self, edges):
+        """ Returns the blocks in columns which have moved into, or changed
+              between the edge and inside of, the view. """
 
+        old_min, old_max = self._edges[0] - 1, self._edges[1]
+        new_min, new_max = edges[0] - 1, edges[1]
+
+        self._floating = {pos for pos in self._floating if edges[0] <= pos[0] < edges[1]}
+
+        def role(x, x_min, x_max):
+            return 'edge' if x in (x_min, x_max) else x_min < x < x_max
+
+        return {(x, y)
+                for x in range(new_min, new_max + 1)
+                if role(x, new_min, new_max) != role(x, old_min, old_max)
+                for y in range(world_gen['height'])}
+
+    def _recheck(self, map_, edges, dirty):
+        x_min, x_max = edges[0] - 1, edges[1]
+        bottom = world_gen['height'] - 1
+
+        def is_ground(pos):
+            return pos[0] in (x_min, x_max) or pos[1] == bottom
+
+        def solid(pos):
+            x, y = pos
+            if not (x_min <= x <= x_max and 0 <= y <= bottom):
+                return False
+            if x in (x_min, x_max):
+                return True
             try:
-                current_block = map_[current_pos[0]][current_pos[1]]
-            except (IndexError, KeyError):
-                current_block = None
+                return is_solid(map_[x][y])
+            except KeyError:
+                return False
 
-            if (current_block is not None and
-                    is_solid(current_block)) or current_pos[0] in (edges[0]-1, edges[1]):
+        # Blocks which have changed, and the blocks around them, might have
+        #   been connected or disconnected.
+        self._floating.difference_update(pos for pos in dirty if not solid(pos))
+        to_check = {(x + dx, y + dy) for x, y in dirty for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
 
-                connected_to_ground.add(current_pos)
-                for (dx, dy) in ((x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)):
-                    pos = (current_pos[0] + dx, current_pos[1] + dy)
+        grounded = set()
+        floating = set()
 
-                    if pos not in visted_blocks:
-                        blocks_to_explore.add(pos)
+        for pos in to_check:
+            if pos in grounded or pos in floating or not solid(pos):
+                continue
+
+            # Search for the ground
+            found_ground = False
+            visited = {pos}
+            stack = [pos]
+            while stack:
+                current_pos = stack.pop()
+                if is_ground(current_pos) or current_pos in grounded:
+                    found_ground = True
+                    break
+
+                for dx, dy in NEIGHBOURS_DOWN_LAST:
+                    next_pos = (current_pos[0] + dx, current_pos[1] + dy)
+                    if next_pos not in visited and solid(next_pos):
+                        visited.add(next_pos)
+                        stack.append(next_pos)
+
+            if found_ground:
+                grounded |= visited
+            else:
+                floating |= visited
 
-    return connected_to_ground
+        # Blocks which were floating might now be connected through the
+        #   grounded blocks.
+        stack = [(x, y) for x, y in self._floating - grounded
+                 if any((x + dx, y + dy) in grounded for dx, dy in NEIGHBOURS_DOWN_LAST)]
+        grounded.update(stack)
+        while stack:
+            x, y = stack.pop()
+            for dx, dy in NEIGHBOURS_DOWN_LAST:
+                next_pos = (x + dx, y + dy)
+                if next_pos in self._floating and next_pos not in grounded:
+                    grounded.add(next_pos)
+                    stack.append(next_pos)
+
+        self._floating -= grounded
+        self._floating |= floating
 
 
 def spawn_hierarchy(tests):
@@ -101,10 +286,11 @@ def in_chunk(pos, chunk_pos):
 
 class TerrainCache(OrderedDict):
     """ Implements a Dict with a size limit.
-        Beyond which it replaces the oldest item. """
+        Beyond which it replaces the oldest item, passing it to on_evict. """
 
     def __init__(self, *args, **kwds):
         self._limit = kwds.pop("limit", None)
+        self._on_evict = kwds.pop("on_evict", None)
         OrderedDict.__init__(self, *args, **kwds)
         self._check_limit()
 
@@ -115,285 +301,519 @@ class TerrainCache(OrderedDict):
     def _check_limit(self):
         if self._limit is not None:
             while len(self) > self._limit:
-                self.popitem(last=False)
+                key, value = self.popitem(last=False)
+                if self._on_evict is not None:
+                    self._on_evict(key, value)
+
+
+class FeatureTable:
+    """
+        The features of one type in a region, sorted by x.
+
+        A feature at x can change the slices from x - reach[0] up to
+            x + reach[1], its footprint.
+    """
+
+    def __init__(self, reach):
+        self._reach = reach
+        self._xs = []
+        self._features = []
+
+    def add(self, x, feature):
+        """ Features must be added in order of x. """
+
+        self._xs.append(x)
+        self._features.append(feature)
+
+    def overlapping(self, x_min, x_max):
+        """ Returns the (x, feature) pairs whose footprint overlaps x_min to x_max. """
+
+        start = bisect_right(self._xs, x_min - self._reach[1])
+        end = bisect_left(self._xs, x_max + self._reach[0])
+        return zip(self._xs[start:end], self._features[start:end])
+
+    def dump(self):
+        return [self._xs, self._features]
+
+    def load(self, data):
+        self._xs, self._features = data
+
+
+class Region:
+    """
+        The features of REGION_SIZE slices, generated in layers:
+
+        - FEATURES: hills and biomes
+        - LANDSCAPE: the ground height and biome of each slice
+        - DETAILS: trees, ores, grass and the cave CA's initial air
+
+        Caves are run per chunk, when the chunk is built.
+    """
+
+    def __init__(self, region_n):
+        self.x = region_n * REGION_SIZE
+        self.layer = 0
+
+        self.tables = {name: FeatureTable(reach) for name, reach in FEATURE_REACH.items()}
+
+        self.ground_heights = {}
+        self.slices_biome = {}
+        self.cave_initial_air = {}
+
+        # Keyed by the chunk's x
+        self.caves = {}
+
+    @property
+    def xs(self):
+        return range(self.x, self.x + REGION_SIZE)
+
+    def dump(self):
+        """ Returns the region as JSON. """
+
+        # The per slice values are stored as lists, in order of x.
+        return {
+            'layer': self.layer,
+            'tables': {name: table.dump() for name, table in self.tables.items()},
+            'ground_heights': [self.ground_heights[x] for x in self.xs] if self.ground_heights else None,
+            'slices_biome': [self.slices_biome[x] for x in self.xs] if self.slices_biome else None,
+            'cave_initial_air': [self.cave_initial_air[x] for x in self.xs] if self.cave_initial_air else None,
+            'caves': {chunk_x: list(cave.items()) for chunk_x, cave in self.caves.items()}
+        }
+
+    def merge(self, other):
+        """ Adds the layers and caves generated in another copy of the
+              region. They are the same wherever they were generated. """
+
+        if other.layer > self.layer:
+            self.layer = other.layer
+            self.tables = other.tables
+            self.ground_heights = other.ground_heights
+            self.slices_biome = other.slices_biome
+            self.cave_initial_air = other.cave_initial_air
+
+        self.caves.update(other.caves)
+
+    @classmethod
+    def load(cls, region_n, data):
+        region = cls(region_n)
+        region.layer = data['layer']
+
+        for name, table in data['tables'].items():
+            region.tables[name].load(table)
+
+        if data['ground_heights'] is not None:
+            region.ground_heights = dict(zip(region.xs, data['ground_heights']))
+        if data['slices_biome'] is not None:
+            region.slices_biome = {x: tuple(biome) for x, biome in zip(region.xs, data['slices_biome'])}
+        if data['cave_initial_air'] is not None:
+            region.cave_initial_air = dict(zip(region.xs, data['cave_initial_air']))
+
+        region.caves = {int(chunk_x): dict(cave) for chunk_x, cave in data['caves'].items()}
+
+        return region
+
+
+class RegionStore:
+    """
+        Keeps the generated regions of a save on disk, so their features are
+            only generated once.
+
+        Each region is a zlib compressed JSON file, loaded when the region
+            is first needed. Regions which have had more generated are marked
+            dirty, and written when they leave the cache or are flushed.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._dirty = {}  # {(seed, terrain_version, region_n): region}
+        self._lock = Lock()  # Guards _dirty
+
+    def _file_name(self, version, region_n):
+        return os.path.join(self._path, 'v{}'.format(version), '{}.region'.format(region_n))
+
+    def load(self, meta, region_n):
+        """ Returns the stored region, or None if it hasn't been stored. """
+
+        file_name = self._file_name(meta.get('terrain_version', LEGACY_TERRAIN), region_n)
+        try:
+            with open(file_name, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            log('Cannot load region', region_n, e)
+            return None
+
+        if data['seed'] != meta['seed']:
+            return None
+
+        return Region.load(region_n, data)
+
+    def mark_dirty(self, key, region):
+        """ Marks the region, cached under key, to be written. """
+        with self._lock:
+            self._dirty[key] = region
+
+    def evicted(self, key, region):
+        """ Writes the region if it's dirty, as it has left the cache. """
+
+        with self._lock:
+            dirty = self._dirty.pop(key, None)
+
+        if dirty is not None:
+            self._write(key, dirty)
+
+    def merge(self, key, region):
+        """ Writes the region, generated by another process, merged with the
+              stored one. """
+
+        seed, version, region_n = key
+        stored = self.load({'seed': seed, 'terrain_version': version}, region_n)
+        if stored is not None:
+            stored.merge(region)
+            region = stored
+
+        self._write(key, region)
+
+    def flush(self):
+        """ Writes every dirty region. """
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+
+        for key, region in dirty.items():
+            self._write(key, region)
+
+    def _write(self, key, region):
+        seed, version, region_n = key
+        file_name = self._file_name(version, region_n)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+        data = region.dump()
+        data['seed'] = seed
+
+        # Replace the file in one go, as other processes might be reading it.
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(json.dumps(data, separators=(',', ':')).encode()))
+            os.replace(temp_name, file_name)
+        except OSError as e:
+            log('Cannot save region', region_n, e)
+            try:
+                os.remove(temp_name)
+            except OSError:
+                pass
 
 
 # TODO: This probably shouldn't stay here...
 features = None
-def init_features():
-    global features
-    cache_size = (world_gen['max_biome'] * 4) + world_gen['chunk_size']
-    features = TerrainCache(limit=cache_size)
+region_store = None
+def init_features(store=None):
+    """ Clears the cached regions. With a RegionStore, regions are also
+          loaded from and saved to it. """
+
+    global features, region_store
+    features = TerrainCache(limit=REGION_CACHE_SIZE, on_evict=store and store.evicted)
+    region_store = store
 
 init_features()
 
 
-# # TODO: Use this for the other functions!
-# def gen_features(generator, features, feature_group_name, chunk_pos, meta):
-#     """ Ensures the features within `range` exist in `features` """
+def flush_regions():
+    """ Writes the cached regions which have changed to the RegionStore. """
+    if region_store:
+        region_store.flush()
 
-#     feature_cache = features[feature_group_name]
 
-#     for x in range(chunk_pos - RAD, chunk_pos + world_gen['chunk_size'] + RAD):
-#         if feature_cache.get(chunk_pos) is None:
+def terrain_rng(meta):
+    return feature_rng(meta['seed'], meta.get('terrain_version', LEGACY_TERRAIN) >= HASH_TERRAIN)
 
-#             # Init to empty, so 'no features' is cached.
-#             feature_cache[chunk_pos] = {}
 
-#             random.seed(str(meta['seed']) + str(chunk_pos) + feature_group_name)
-#             feature_cache[chunk_pos]['biome'] = generator()
+def region_key(region_n, meta):
+    return meta['seed'], meta.get('terrain_version', LEGACY_TERRAIN), region_n
 
 
-def gen_biome_features(features, chunk_pos, meta):
-    for x in range(chunk_pos - world_gen['max_biome'], chunk_pos + world_gen['chunk_size'] + world_gen['max_biome']):
+def get_region(region_n, meta, layer):
+    """ Returns the region, with its features generated up to `layer`. """
 
-        # TODO: Each of these `if` blocks should be abstracted into a function
-        #         which just returns the `attrs` object.
+    key = region_key(region_n, meta)
 
-        if features.get(x) is None:
-            # Init to empty, so 'no features' is cached.
-            features[x] = {}
+    region = features.get(key)
+    if region is None:
+        region = region_store and region_store.load(meta, region_n)
+        region = features[key] = region or Region(region_n)
+    else:
+        features.move_to_end(key)
 
-        # If it is not None, it has all ready been generated.
-        if features[x].get('biome') is None:
+    if region.layer < layer:
+        while region.layer < layer:
+            REGION_LAYERS[region.layer](region, meta)
+            region.layer += 1
 
-            random.seed(str(meta['seed']) + str(x) + 'biome')
-            if random.random() <= 0.05:
+        if region_store:
+            region_store.mark_dirty(key, region)
 
-                # TODO: Move outside function
-                biomes_population = []
-                for name, data in world_gen['biomes'].items():
-                    biomes_population.extend([name] * int(data['chance'] * 100))
+    return region
 
-                attrs = {}
-                attrs['type'] = random.choice(sorted(biomes_population))
-                attrs['radius'] = random.randint(world_gen['min_biome'], world_gen['max_biome'])
 
-                features[x]['biome'] = attrs
+def regions_overlapping(x_min, x_max, meta, layer):
+    """ Returns the regions between x_min and x_max, generated up to `layer`. """
 
+    return [get_region(region_n, meta, layer)
+            for region_n in range(x_min // REGION_SIZE, (x_max - 1) // REGION_SIZE + 1)]
 
-def gen_hill_features(features, chunk_pos, meta):
-    for x in range(chunk_pos - MAX_HILL_RAD, chunk_pos + world_gen['chunk_size'] + MAX_HILL_RAD):
 
-        # TODO: Each of these `if` blocks should be abstracted into a function
-        #         which just returns the `attrs` object.
+def features_overlapping(feature_name, x_min, x_max, meta, layer):
+    """ Returns the (x, feature) pairs of one type whose footprint overlaps
+          x_min to x_max, in order of x. """
 
-        if features.get(x) is None:
-            # Init to empty, so 'no features' is cached.
-            features[x] = {}
+    reach = FEATURE_REACH[feature_name]
 
-        # If it is not None, it has all ready been generated.
-        if features[x].get('hill') is None:
+    return [feature
+            for region in regions_overlapping(x_min - reach[1] + 1, x_max + reach[0], meta, layer)
+            for feature in region.tables[feature_name].overlapping(x_min, x_max)]
 
-            random.seed(str(meta['seed']) + str(x) + 'hill')
-            if random.random() <= 0.05:
 
-                attrs = {}
-                attrs['gradient_l'] = random.randint(1, world_gen['min_grad'])
-                attrs['gradient_r'] = random.randint(1, world_gen['min_grad'])
-                attrs['height'] = random.randint(0, world_gen['max_hill'])
+def gen_biome_features(region, meta):
+    rng = terrain_rng(meta)
+    alias = meta.get('terrain_version', LEGACY_TERRAIN) >= ALIAS_TERRAIN
 
-                features[x]['hill'] = attrs
+    xs = region.xs
+    for x, chance in zip(xs, rng.random(xs, 'biome')):
+        if chance <= 0.05:
+            random = rng.stream(x, 'biome', skip=1)
 
+            attrs = {}
+            attrs['type'] = BIOME_TABLE.sample(random) if alias else random.choice(LEGACY_BIOMES)
+            attrs['radius'] = random.randint(world_gen['min_biome'], world_gen['max_biome'])
 
-def gen_tree_features(features, ground_heights, slices_biome, chunk_pos, meta):
-    for x in range(chunk_pos - MAX_HALF_TREE, chunk_pos + world_gen['chunk_size'] + MAX_HALF_TREE):
+            region.tables['biome'].add(x, attrs)
 
-        # TODO: Each of these `if` blocks should be abstracted into a function
-        #         which just returns the `attrs` object.
 
-        if features.get(x) is None:
-            # Init to empty, so 'no features' is cached.
-            features[x] = {}
+def gen_hill_features(region, meta):
+    rng = terrain_rng(meta)
 
-        # If it is not None, it has all ready been generated.
-        if features[x].get('tree') is None:
+    xs = region.xs
+    for x, chance in zip(xs, rng.random(xs, 'hill')):
+        if chance <= 0.05:
+            random = rng.stream(x, 'hill', skip=1)
 
-            biome_data = world_gen['biomes'][slices_biome[x][0]]
-            boime_tree_chance = biome_data['trees']
+            attrs = {}
+            attrs['gradient_l'] = random.randint(1, world_gen['min_grad'])
+            attrs['gradient_r'] = random.randint(1, world_gen['min_grad'])
+            attrs['height'] = random.randint(0, world_gen['max_hill'])
 
-            random.seed(str(meta['seed']) + str(x) + 'tree')
-            type_ = random.randint(0, len(world_gen['trees'])-1)
-            tree_data = world_gen['trees'][type_]
+            region.tables['hill'].add(x, attrs)
 
-            tree_chance = boime_tree_chance * tree_data['chance']
 
-            if random.random() <= tree_chance:
+def gen_landscape_features(region, meta):
+    gen_biome_features(region, meta)
+    gen_hill_features(region, meta)
 
-                attrs = {}
-                attrs['type'] = type_
 
-                leaves = tree_data['leaves']
+def gen_landscape(region, meta):
+    """ Generate hill heights and biomes map for the tree and ore generation. """
 
-                # Centre tree slice (contains trunk)
-                # TODO: This calculation could be done on start-up, and stored
-                #         with each tree type.
-                center_leaves = leaves[int(len(leaves) / 2)]
-                if 1 in center_leaves:
-                    attrs['trunk_depth'] = center_leaves[::-1].index(1)
-                else:
-                    attrs['trunk_depth'] = len(center_leaves)
+    x_min, x_max = region.xs[0], region.xs[-1] + 1
 
-                # Get space above ground
-                air_height = world_gen['height'] - ground_heights[x]
-                tree_height = air_height - (len(center_leaves) - attrs['trunk_depth'])
-                tree_height = min(tree_height, tree_data['min_height'])
+    hills = features_overlapping('hill', x_min, x_max, meta, FEATURES)
+    biomes = features_overlapping('biome', x_min, x_max, meta, FEATURES)
 
-                attrs['height'] = random.randint(tree_data['min_height'], max(tree_height, 2))
+    if USE_NUMPY:
+        region.ground_heights = gen_ground_heights_numpy(hills, x_min, x_max)
+        region.slices_biome = gen_slices_biome_numpy(biomes, x_min, x_max)
+    else:
+        region.ground_heights = gen_ground_heights(hills, x_min, x_max)
+        region.slices_biome = gen_slices_biome(biomes, x_min, x_max)
 
-                features[x]['tree'] = attrs
 
+def tree_types(region, meta):
+    """ Yields (x, tree type, stream) for each slice with a tree. """
 
-def gen_ore_features(features, ground_heights, slices_biome, chunk_pos, meta):
-    for x in range(chunk_pos - MAX_ORE_RANGE[0], chunk_pos + world_gen['chunk_size'] + MAX_ORE_RANGE[1]):
+    rng = terrain_rng(meta)
 
-        # TODO: Each of these `if` blocks should be abstracted into a function
-        #         which just returns the `attrs` object.
+    if meta.get('terrain_version', LEGACY_TERRAIN) >= ALIAS_TERRAIN:
+        # Check for a tree first, then draw its type by the tree chances
+        xs = region.xs
+        for x, chance in zip(xs, rng.random(xs, 'tree')):
+            if chance <= world_gen['biomes'][region.slices_biome[x][0]]['trees'] * TREE_CHANCE:
+                random = rng.stream(x, 'tree', skip=1)
+                yield x, TREE_TABLE.sample(random), random
 
-        if features.get(x) is None:
-            # Init to empty, so 'no features' is cached.
-            features[x] = {}
+    else:
+        # Draw any type, then check for a tree with that type's chance
+        for x in region.xs:
+            random = rng.stream(x, 'tree')
+            type_ = random.randint(0, len(world_gen['trees'])-1)
 
-        # Ores
-        # NOTE: Ores seem to be the way to model the generalization of the
-        #         rest of the features after
-        for name, ore in world_gen['ores'].items():
-            feature_name = name + '_ore_root'
+            tree_chance = world_gen['biomes'][region.slices_biome[x][0]]['trees'] * world_gen['trees'][type_]['chance']
+            if random.random() <= tree_chance:
+                yield x, type_, random
 
-            # If it is not None, it has all ready been generated.
-            if features[x].get(feature_name) is None:
 
-                random.seed(str(meta['seed']) + str(x) + feature_name)
-                if random.random() <= ore['chance']:
+def gen_tree_features(region, meta):
+    for x, type_, random in tree_types(region, meta):
+        tree_data = world_gen['trees'][type_]
 
-                    upper = int(world_gen['height'] * ore['upper'])
-                    lower = int(world_gen['height'] * ore['lower'])
+        attrs = {}
+        attrs['type'] = type_
 
-                    attrs = {}
-                    attrs['root_height'] = world_gen['height'] - random.randint(
-                        lower, min(upper, (ground_heights[x] - 1))  # -1 for grass.
-                    )
+        stamp = TREE_STAMPS[type_]
 
-                    # Generates ore at random position around root ore
-                    pot_vain_blocks = ore['vain_size'] ** 2
+        # Get space above ground
+        air_height = world_gen['height'] - region.ground_heights[x]
+        tree_height = air_height - (stamp.leaves_height - stamp.trunk_depth)
+        tree_height = min(tree_height, tree_data['min_height'])
 
-                    # Describes the shape of the vain,
-                    #   top to bottom, left to right.
-                    attrs['vain_shape'] = [b / 100 for b in random.sample(range(0, 100), pot_vain_blocks)]
+        attrs['height'] = random.randint(tree_data['min_height'], max(tree_height, 2))
 
-                    features[x][feature_name] = attrs
+        region.tables['tree'].add(x, attrs)
 
 
-def gen_grass_features(features, ground_heights, slices_biome, chunk_pos, meta):
-    for x in range(chunk_pos, chunk_pos + world_gen['chunk_size']):
+def gen_ore_features(region, meta):
+    rng = terrain_rng(meta)
+
+    # Ores
+    # NOTE: Ores seem to be the way to model the generalization of the
+    #         rest of the features after
+    xs = region.xs
+    for name, ore in world_gen['ores'].items():
+        feature_name = name + '_ore_root'
 
-        # TODO: Each of these `if` blocks should be abstracted into a function
-        #         which just returns the `attrs` object.
+        for x, chance in zip(xs, rng.random(xs, feature_name)):
+            if chance <= ore['chance']:
+                random = rng.stream(x, feature_name, skip=1)
 
-        if features.get(x) is None:
-            # Init to empty, so 'no features' is cached.
-            features[x] = {}
+                upper = int(world_gen['height'] * ore['upper'])
+                lower = int(world_gen['height'] * ore['lower'])
 
-        # If it is not None, it has all ready been generated.
-        if features[x].get('grass') is None:
+                attrs = {}
+                attrs['root_height'] = world_gen['height'] - random.randint(
+                    lower, min(upper, (region.ground_heights[x] - 1))  # -1 for grass.
+                )
 
-            biome_data = world_gen['biomes'][slices_biome[x][0]]
-            grass_chance = biome_data['grass']
+                # Generates ore at random position around root ore
+                pot_vain_blocks = ore['vain_size'] ** 2
 
-            random.seed(str(meta['seed']) + str(x) + 'grass')
-            if random.random() <= grass_chance:
+                # Describes the shape of the vain,
+                #   top to bottom, left to right.
+                attrs['vain_shape'] = [b / 100 for b in random.sample(range(0, 100), pot_vain_blocks)]
 
-                attrs = {}
-                attrs['y'] = ground_heights[x]
+                region.tables[feature_name].add(x, attrs)
+
+
+def gen_grass_features(region, meta):
+    rng = terrain_rng(meta)
+
+    xs = region.xs
+    for x, chance in zip(xs, rng.random(xs, 'grass')):
+        biome_data = world_gen['biomes'][region.slices_biome[x][0]]
+        grass_chance = biome_data['grass']
 
-                features[x]['grass'] = attrs
+        if chance <= grass_chance:
 
+            attrs = {}
+            attrs['y'] = region.ground_heights[x]
 
-def gen_cave_features(features, ground_heights, slices_biome, chunk_pos, meta):
+            region.tables['grass'].add(x, attrs)
 
-    cave_y_res = 2  # Double the y resolution of the CA to correct for aspect ratio
-    ca_iterations = 6
 
-    air_points = set()
-    air_points_x_min = chunk_pos - ca_iterations
-    air_points_x_max = chunk_pos + world_gen['chunk_size'] + ca_iterations
+def gen_cave_initial_air(region, meta):
+    rng = terrain_rng(meta)
 
-    for x in range(air_points_x_min, air_points_x_max):
+    # The CA grid is stored as one bitmask per slice, where bit y is set for
+    #   air at CA row y. CA row y is at world_y = height - (y / CAVE_Y_RES) - 2.
+    for x in region.xs:
+        chances = rng.randoms(x, 'cave', CAVE_Y_RES * (region.ground_heights[x] - 2))
+        bits = ''.join('1' if chance < world_gen['cave_chance'] else '0' for chance in reversed(chances))
 
-        # TODO: Each of these `if` blocks should be abstracted into a function
-        #         which just returns the `attrs` object.
+        region.cave_initial_air[x] = int(bits or '0', 2)
 
-        if features.get(x) is None:
-            # Init to empty, so 'no features' is cached.
-            features[x] = {}
 
-        # If it is not None, it has all ready been generated.
-        if features[x].get('cave_initial_air_points') is None:
-            random.seed(str(meta['seed']) + str(x) + 'cave')
+def gen_detail_features(region, meta):
+    gen_tree_features(region, meta)
+    gen_ore_features(region, meta)
+    gen_grass_features(region, meta)
+    gen_cave_initial_air(region, meta)
 
-            # Generate air points for this slice
-            slice_air_points = set()
-            for y in range(cave_y_res * (ground_heights[x] - 2)):
-                world_y = world_gen['height'] - (y/cave_y_res) - 2
 
-                if random.random() < world_gen['cave_chance']:
-                    slice_air_points.add((x, world_y))
+def gen_cave_features(chunk_pos, meta):
+    """ Returns the caves carved by the chunk at chunk_pos, which overlap
+          CAVE_ITERATIONS slices into the chunks either side. """
 
-            if slice_air_points:
-                features[x]['cave_initial_air_points'] = slice_air_points
+    region_n = chunk_pos // REGION_SIZE
+    region = get_region(region_n, meta, DETAILS)
 
-        # Store slice air points in our local collection of air points for CA generation
-        if features[x].get('cave_initial_air_points'):
-            air_points = air_points.union(features[x]['cave_initial_air_points'])
+    if region.caves.get(chunk_pos) is None:
+        air_x_min = chunk_pos - CAVE_ITERATIONS
+        air_x_max = chunk_pos + world_gen['chunk_size'] + CAVE_ITERATIONS
+
+        air = {}
+        rows = {}
+        for air_region in regions_overlapping(air_x_min, air_x_max, meta, DETAILS):
+            for x in range(max(air_x_min, air_region.x), min(air_x_max, air_region.x + REGION_SIZE)):
+                air[x] = air_region.cave_initial_air[x]
+
+                # Cells which are in the CA grid
+                rows[x] = (1 << (CAVE_Y_RES * (air_region.ground_heights[x] - 2))) - 1
 
-    if features[chunk_pos].get('cave') is None:
         # Perform cellular automata
-        for i in range(ca_iterations):
-            new_air_points = set()
+        for i in range(CAVE_ITERATIONS):
+            air = {x: rows[x] & ~cave_neighbours_at_least_5(air, x) for x in air}
+
+        region.caves[chunk_pos] = {x: bits for x, bits in air.items() if bits}
+
+        if region_store:
+            region_store.mark_dirty(region_key(region_n, meta), region)
+
+    return region.caves[chunk_pos]
+
 
-            for x in range(air_points_x_min, air_points_x_max):
-                for y in range(cave_y_res * (ground_heights[x] - 2)):
-                    world_y = world_gen['height'] - (y/cave_y_res) - 2
+def cave_neighbours_at_least_5(air, x):
+    """
+        Returns a bitmask of the CA rows in slice x with at least 5 air cells
+            in their 3x3 neighbourhood, counting the cell itself.
 
-                    n_neighbours = 0
-                    for dx in (-1, 0, 1):
-                        for dy in (-(1/cave_y_res), 0, (1/cave_y_res)):
-                            if (x + dx, world_y + dy) in air_points:
-                                n_neighbours += 1
+        The count for every row is summed at once in 4 bit-sliced planes.
+    """
 
-                    if n_neighbours < 5:
-                        new_air_points.add((x, world_y))
+    count = [0, 0, 0, 0]
 
-            air_points = new_air_points
+    for dx in (-1, 0, 1):
+        bits = air.get(x + dx, 0)
 
-        features[chunk_pos]['cave'] = air_points
+        for neighbours in (bits << 1, bits, bits >> 1):
+            # Ripple carry add the neighbours into the count
+            for i in range(len(count)):
+                carry = count[i] & neighbours
+                count[i] ^= neighbours
+                neighbours = carry
 
+                if not neighbours:
+                    break
+
+    # 5, 6, 7 or >= 8
+    return count[3] | (count[2] & (count[1] | count[0]))
+
+
+FEATURES, LANDSCAPE, DETAILS = 1, 2, 3
+REGION_LAYERS = (gen_landscape_features, gen_landscape, gen_detail_features)
 
 
 def build_tree(chunk, chunk_pos, x, tree_feature, ground_heights):
     """ Adds a tree feature at x to the chunk. """
 
+    stamp = TREE_STAMPS[tree_feature['type']]
+    air_height = world_gen['height'] - ground_heights[x]
+
     # Add trunk
     if in_chunk(x, chunk_pos):
-        air_height = world_gen['height'] - ground_heights[x]
-        for trunk_y in range(air_height - tree_feature['height'], air_height - (bool(DEBUG) * 3)):
-            chunk[x][trunk_y] = spawn_hierarchy(('|', chunk[x][trunk_y]))
+        TRUNK.paint(chunk[x], air_height - tree_feature['height'], air_height - (bool(DEBUG) * 3))
 
     # Add leaves
-    leaves = world_gen['trees'][tree_feature['type']]['leaves']
-    half_leaves = int(len(leaves) / 2)
-
-    for leaf_dx, leaf_slice in enumerate(leaves):
-        leaf_x = x + (leaf_dx - half_leaves)
-
-        if in_chunk(leaf_x, chunk_pos):
-            air_height = world_gen['height'] - ground_heights[x]
-            leaf_height = air_height - tree_feature['height'] - len(leaf_slice) + tree_feature['trunk_depth']
-
-            for leaf_dy, leaf in enumerate(leaf_slice):
-                if (bool(DEBUG) and leaf_dy == 0) or (not bool(DEBUG) and leaf):
-                    leaf_y = leaf_height + leaf_dy
-                    chunk[leaf_x][leaf_y] = spawn_hierarchy(('@', chunk[leaf_x][leaf_y]))
+    leaves_y = air_height - tree_feature['height'] - stamp.leaves_height + stamp.trunk_depth
+    stamp.leaves.place(chunk, chunk_pos, x, leaves_y)
 
 
 def build_grass(chunk, chunk_pos, x, grass_feature, ground_heights):
@@ -407,85 +827,190 @@ def build_grass(chunk, chunk_pos, x, grass_feature, ground_heights):
 def build_ore(chunk, chunk_pos, x, ore_feature, ore, ground_heights):
     """ Adds an ore feature at x to the chunk. """
 
-    for block_pos in range(ore['vain_size'] ** 2):
-        if ore_feature['vain_shape'][block_pos] < ore['vain_density']:
+    vain = [block < ore['vain_density'] for block in ore_feature['vain_shape']]
 
-            # Centre on root ore
-            block_dx = (block_pos % ore['vain_size']) - int((ore['vain_size'] - 1) / 2)
-            block_dy = int(block_pos / ore['vain_size']) - int((ore['vain_size'] - 1) / 2)
+    # Only replace blocks below the grass
+    ORE_STAMPS[ore['char']].place(chunk, chunk_pos, x, ore_feature['root_height'], vain, ground_heights)
 
-            block_x = block_dx + x
-            block_y = block_dy + ore_feature['root_height']
 
-            if not in_chunk(block_x, chunk_pos):
-                continue
+def build_cave(chunk, chunk_pos, x, cave_feature, ground_heights):
+    """ Adds caves at x to the chunk. """
 
-            if not world_gen['height'] > block_y > world_gen['height'] - ground_heights[block_x]:
-                continue
+    for world_x, bits in cave_feature.items():
+        if in_chunk(world_x, chunk_pos):
 
-            if chunk[block_x][block_y] is ' ':
+            # CA rows 2n and 2n - 1 both fall in world row height - n - 2.
+            bits |= bits << 1
+
+            for n, air in enumerate(bin(bits)[:1:-1][::CAVE_Y_RES]):
+                if air == '1':
+                    chunk[world_x][world_gen['height'] - n - 2] = ' '
+
+
+class Paint:
+    """ One block, placed over any block of lower or equal hierarchy. """
+
+    def __init__(self, block, keep=()):
+        self.block = block
+        self.overwrites = frozenset(key for key, data in blocks.items()
+                                    if data.get('hierarchy', float('inf')) <= blocks[block]['hierarchy'] and
+                                       key not in keep)
+
+    def paint(self, slice_, top, bottom):
+        """ Paints the block from y = top to bottom. """
+
+        top = max(top, 0)
+        slice_[top:bottom] = [self.block if block in self.overwrites else block for block in slice_[top:bottom]]
+
+
+class Stamp:
+    """
+        A pattern of cells of one block, compiled for placing into chunks.
+
+        Each column of the pattern is stored as its top offset and a mask,
+            so placing it changes each slice with one clipped masked write.
+    """
+
+    def __init__(self, paint, cells):
+        """ `cells` is a sequence of (dx, dy) offsets from the stamp's origin. """
+
+        self.paint = paint
+
+        self.dx_min = min((dx for dx, dy in cells), default=0)
+        self.dx_max = max((dx for dx, dy in cells), default=-1)
+
+        # (dx, top dy, mask, index of the cell in each row or None)
+        self.columns = []
+        for dx in range(self.dx_min, self.dx_max + 1):
+            column = {dy: i for i, (cell_dx, dy) in enumerate(cells) if cell_dx == dx}
+
+            if column:
+                indices = tuple(column.get(dy) for dy in range(min(column), max(column) + 1))
+                mask = tuple(i is not None for i in indices)
+                self.columns.append((dx, min(column), mask, indices))
+
+    def place(self, chunk, chunk_pos, x, y, cells_on=None, ground_heights=None):
+        """
+            Places the stamp with its origin at (x, y), clipped to the chunk and world.
+
+            `cells_on` picks which cells are placed, by their index in the
+                stamp's cells. With `ground_heights` only the blocks below
+                the surface are changed.
+        """
+
+        # Clip to the chunk
+        if x + self.dx_max < chunk_pos or x + self.dx_min >= chunk_pos + world_gen['chunk_size']:
+            return
+
+        block = self.paint.block
+        overwrites = self.paint.overwrites
+
+        for dx, dy, mask, indices in self.columns:
+            stamp_x = x + dx
+            if not in_chunk(stamp_x, chunk_pos):
                 continue
 
-            chunk[block_x][block_y] = spawn_hierarchy((ore['char'], chunk[block_x][block_y]))
+            if cells_on is not None:
+                mask = [i is not None and cells_on[i] for i in indices]
 
+            top = y + dy
+            bottom = min(top + len(mask), world_gen['height'])
 
-def build_cave(chunk, chunk_pos, x, cave_feature, ground_heights):
-    """ Adds caves at x to the chunk. """
+            min_top = 0 if ground_heights is None else max(0, world_gen['height'] - ground_heights[stamp_x] + 1)
+            if min_top > top:
+                mask = mask[min_top - top:]
+                top = min_top
 
-    for (world_x, y) in cave_feature:
-        if in_chunk(world_x, chunk_pos):
-            chunk[world_x][int(y)] = ' '
+            slice_ = chunk[stamp_x]
+            slice_[top:bottom] = [block if stamped and old in overwrites else old
+                                  for stamped, old in zip(mask, slice_[top:bottom])]
 
 
-def gen_chunk(chunk_n, meta):
-    chunk_pos = chunk_n * world_gen['chunk_size']
+class TreeStamp:
+    """ A tree type compiled for placing into chunks. """
 
-    # TODO: Allow more than one feature per x in features?
+    def __init__(self, tree):
+        leaves = tree['leaves']
+        half_leaves = int(len(leaves) / 2)
 
-    # First generate all the features we will need
-    #   for all the slice is in this chunk
+        # Centre tree slice (contains trunk)
+        center_leaves = leaves[half_leaves]
+        if 1 in center_leaves:
+            self.trunk_depth = center_leaves[::-1].index(1)
+        else:
+            self.trunk_depth = len(center_leaves)
 
-    gen_biome_features(features, chunk_pos, meta)
-    gen_hill_features(features, chunk_pos, meta)
+        self.leaves_height = len(center_leaves)
 
-    # Generate hill heights and biomes map for the tree and ore generation.
-    ground_heights = {x: world_gen['ground_height'] for x in range(chunk_pos - MAX_HILL_RAD, chunk_pos + world_gen['chunk_size'] + MAX_HILL_RAD)}
-    # Store feature_x with the value for calculating precedence.
-    slices_biome = {x: ('normal', None) for x in range(chunk_pos - world_gen['max_biome'], chunk_pos + world_gen['chunk_size'] + world_gen['max_biome'])}
+        self.leaves = Stamp(LEAVES, [(leaf_dx - half_leaves, leaf_dy)
+                                     for leaf_dx, leaf_slice in enumerate(leaves)
+                                     for leaf_dy, leaf in enumerate(leaf_slice)
+                                     if (bool(DEBUG) and leaf_dy == 0) or (not bool(DEBUG) and leaf)])
+
+
+def ore_stamp(ore):
+    """ Compiles the square an ore vain can fill, centred on its root ore. """
+
+    size = ore['vain_size']
+    centre = int((size - 1) / 2)
+
+    # Ores never replace air (caves)
+    return Stamp(Paint(ore['char'], keep=' '), [(block_pos % size - centre, int(block_pos / size) - centre)
+                                              for block_pos in range(size ** 2)])
+
+
+TRUNK = Paint('|')
+LEAVES = Paint('@')
+TREE_STAMPS = tuple(TreeStamp(tree) for tree in world_gen['trees'])
+ORE_STAMPS = {ore['char']: ore_stamp(ore) for ore in world_gen['ores'].values()}
+
+
+def gen_ground_heights(hills, x_min, x_max):
+    """ Returns the ground height of each slice from x_min to x_max. """
+
+    ground_heights = {x: world_gen['ground_height'] for x in range(x_min, x_max)}
+
+    for feature_x, feature in hills:
+        for d_x in range(-feature['height'] * feature['gradient_l'],
+                         feature['height'] * feature['gradient_r']):
+            x = feature_x + d_x
+
+            gradient = feature['gradient_l'] if d_x < 0 else feature['gradient_r']
+            hill_height = int(feature['height'] - (abs(d_x) / gradient))
 
-    for feature_x, slice_features in features.items():
-        feature_x = int(feature_x)
+            if d_x == 0:
+                hill_height -= 1
 
-        for feature_name, feature in slice_features.items():
+            ground_height = world_gen['ground_height'] + hill_height
 
-            if feature_name == 'hill':
+            if x in ground_heights:
+                ground_heights[x] = max(ground_height, ground_heights[x])
 
-                for d_x in range(-feature['height'] * feature['gradient_l'],
-                                 feature['height'] * feature['gradient_r']):
-                    x = feature_x + d_x
+    return ground_heights
 
-                    gradient = feature['gradient_l'] if d_x < 0 else feature['gradient_r']
-                    hill_height = int(feature['height'] - (abs(d_x) / gradient))
 
-                    if d_x == 0:
-                        hill_height -= 1
+def gen_slices_biome(biomes, x_min, x_max):
+    """ Returns the biome of each slice from x_min to x_max. """
 
-                    ground_height = world_gen['ground_height'] + hill_height
+    # Store feature_x with the value for calculating precedence.
+    slices_biome = {x: ('normal', None) for x in range(x_min, x_max)}
+
+    for feature_x, feature in biomes:
+        for d_x in range(-feature['radius'], feature['radius']):
+            x = feature_x + d_x
 
-                    old_height = ground_heights.get(x, 0)
-                    ground_heights[x] = max(ground_height, old_height)
+            if x in slices_biome:
+                previous_slice_biome_feature_x = slices_biome[x][1]
 
-            elif feature_name == 'biome':
+                if (previous_slice_biome_feature_x is None or
+                        previous_slice_biome_feature_x < feature_x):
+                    slices_biome[x] = (feature['type'], feature_x)
 
-                for d_x in range(-feature['radius'], feature['radius']):
-                    x = feature_x + d_x
+    return slices_biome
 
-                    if x in slices_biome:
-                        previous_slice_biome_feature_x = slices_biome[x][1]
 
-                        if (previous_slice_biome_feature_x is None or
-                                previous_slice_biome_feature_x < feature_x):
-                            slices_biome[x] = (feature['type'], feature_x)
+def gen_base_chunk(ground_heights, chunk_pos):
+    """ Fills the chunk with grass, stone and bedrock up to the ground heights. """
 
     chunk = {}
     for x in range(chunk_pos, chunk_pos + world_gen['chunk_size']):
@@ -496,44 +1021,122 @@ def gen_chunk(chunk_n, meta):
             ['_']
         )
 
-    int_x = list(map(int, ground_heights.keys()))
-    log('chunk', chunk_pos, m=1)
-    log('max', max(int_x), m=1)
-    log('min', min(int_x), m=1)
-    log('gh diff', set(range(chunk_pos - MAX_HILL_RAD, chunk_pos + world_gen['chunk_size'] + MAX_HILL_RAD)) - set(int_x), m=1, trunc=False)
-    log('slices_biome', list(filter(lambda slice_: (int(slice_[0])%16 == 0) or (int(slice_[0])+1)%16 == 0, sorted(slices_biome.items()))), m=1, trunc=False)
+    return chunk
 
-    gen_cave_features(features, ground_heights, slices_biome, chunk_pos, meta)
-    gen_tree_features(features, ground_heights, slices_biome, chunk_pos, meta)
-    gen_ore_features(features, ground_heights, slices_biome, chunk_pos, meta)
-    gen_grass_features(features, ground_heights, slices_biome, chunk_pos, meta)
 
-    log('chunk_pos', chunk_pos, m=1)
-    tree_features = list(filter(lambda f: f[1].get('tree'), features.items()))
-    log('trees in cache\n', [str(f[0]) for f in tree_features], m=1, trunc=0)
-    log('trees in range', [str(f[0]) for f in tree_features if (chunk_pos <= int(f[0]) < chunk_pos + world_gen['chunk_size'])], m=1, trunc=0)
+def gen_ground_heights_numpy(hills, x_min, x_max):
+    """ NumPy version of `gen_ground_heights`, computed for all hills at once. """
 
-    # Insert trees and ores
-    for feature_x, slice_features in features.items():
-        feature_x = int(feature_x)
+    xs = numpy.arange(x_min, x_max)
 
-        for feature_name, feature in slice_features.items():
+    if hills:
+        feature_x = numpy.array([x for x, _ in hills])[:, None]
+        height = numpy.array([hill['height'] for _, hill in hills])[:, None]
+        gradient_l = numpy.array([hill['gradient_l'] for _, hill in hills])[:, None]
+        gradient_r = numpy.array([hill['gradient_r'] for _, hill in hills])[:, None]
 
-            if feature_name == 'tree':
-                build_tree(chunk, chunk_pos, feature_x, feature, ground_heights)
+        # One row per hill, one column per slice.
+        d_x = xs[None, :] - feature_x
+        in_hill = (d_x >= -height * gradient_l) & (d_x < height * gradient_r)
 
-            elif feature_name == 'grass':
-                build_grass(chunk, chunk_pos, feature_x, feature, ground_heights)
+        gradient = numpy.where(d_x < 0, gradient_l, gradient_r)
+        hill_height = (height - (numpy.abs(d_x) / gradient)).astype(int) - (d_x == 0)
 
-            elif feature_name == 'cave':
-                build_cave(chunk, chunk_pos, feature_x, feature, ground_heights)
+        hill_heights = numpy.where(in_hill, world_gen['ground_height'] + hill_height, world_gen['ground_height'])
+        heights = hill_heights.max(axis=0)
+    else:
+        heights = numpy.full(xs.shape, world_gen['ground_height'])
 
-            else:
-                for name, ore in world_gen['ores'].items():
-                    ore_name = name + '_ore_root'
+    return dict(zip(xs.tolist(), heights.tolist()))
+
+
+def gen_slices_biome_numpy(biomes, x_min, x_max):
+    """ NumPy version of `gen_slices_biome`, computed for all biomes at once. """
+
+    xs = numpy.arange(x_min, x_max)
+
+    slices_biome = {x: ('normal', None) for x in xs.tolist()}
+
+    if biomes:
+        feature_x = numpy.array([x for x, _ in biomes])[:, None]
+        radius = numpy.array([biome['radius'] for _, biome in biomes])[:, None]
+
+        # The biome with the greatest feature_x covering a slice takes precedence.
+        d_x = xs[None, :] - feature_x
+        in_biome = (d_x >= -radius) & (d_x < radius)
+        precedence = numpy.where(in_biome, feature_x, numpy.iinfo(feature_x.dtype).min)
+
+        top = precedence.argmax(axis=0)
+        covered = in_biome.any(axis=0)
+
+        for x, i in zip(xs[covered].tolist(), top[covered].tolist()):
+            slices_biome[x] = (biomes[i][1]['type'], biomes[i][0])
+
+    return slices_biome
+
+
+def gen_base_chunk_numpy(ground_heights, chunk_pos):
+    """ NumPy version of `gen_base_chunk`, filling every slice at once. """
+
+    xs = range(chunk_pos, chunk_pos + world_gen['chunk_size'])
+    heights = numpy.array([ground_heights[x] for x in xs])[:, None]
+    ys = numpy.arange(world_gen['height'])[None, :]
+
+    ground_y = world_gen['height'] - heights
+    fill = numpy.where(ys < ground_y, ord(' '),
+                       numpy.where(ys == ground_y, ord('-'), ord('#'))).astype(numpy.uint8)
+    fill[:, -1] = ord('_')
+
+    return {x: list(fill[i].tobytes().decode('ascii')) for i, x in enumerate(xs)}
+
+
+def gen_chunk(chunk_n, meta):
+    chunk_pos = chunk_n * world_gen['chunk_size']
+    chunk_end = chunk_pos + world_gen['chunk_size']
+
+    # Trees are the widest features built into the chunk.
+    x_min, x_max = chunk_pos - MAX_HALF_TREE, chunk_end + MAX_HALF_TREE + 1
+
+    ground_heights = {}
+    slices_biome = {}
+    for region in regions_overlapping(x_min, x_max, meta, LANDSCAPE):
+        for x in range(max(x_min, region.x), min(x_max, region.x + REGION_SIZE)):
+            ground_heights[x] = region.ground_heights[x]
+            slices_biome[x] = region.slices_biome[x]
+
+    if USE_NUMPY:
+        chunk = gen_base_chunk_numpy(ground_heights, chunk_pos)
+    else:
+        chunk = gen_base_chunk(ground_heights, chunk_pos)
+
+    log('chunk', chunk_pos, m=1)
+    log('slices_biome', lambda: [(x, slices_biome[x]) for x in (chunk_pos, chunk_end - 1)], m=1, trunc=False)
+
+    # Find the features which reach into this chunk, from any region.
+    #   Each chunk's caves also carve into the chunks either side.
+    chunk_features = [(cave_x, -1, 'cave', gen_cave_features(cave_x, meta))
+                      for cave_x in (chunk_pos - world_gen['chunk_size'], chunk_pos, chunk_end)]
+
+    for order, feature_name in enumerate(('tree',) + tuple(ORE_FEATURES) + ('grass',)):
+        chunk_features.extend((feature_x, order, feature_name, feature) for feature_x, feature in
+                              features_overlapping(feature_name, chunk_pos, chunk_end, meta, DETAILS))
+
+    log('trees in range', lambda: [x for x, _, name, _ in chunk_features if name == 'tree'], m=1, trunc=0)
+
+    # Insert trees and ores
+    for feature_x, _, feature_name, feature in sorted(chunk_features, key=lambda f: f[:2]):
+
+        if feature_name == 'tree':
+            build_tree(chunk, chunk_pos, feature_x, feature, ground_heights)
+
+        elif feature_name == 'grass':
+            build_grass(chunk, chunk_pos, feature_x, feature, ground_heights)
+
+        elif feature_name == 'cave':
+            build_cave(chunk, chunk_pos, feature_x, feature, ground_heights)
 
-                    if feature_name == ore_name:
-                        build_ore(chunk, chunk_pos, feature_x, feature, ore, ground_heights)
-                        break
+        else:
+            build_ore(chunk, chunk_pos, feature_x, feature, ORE_FEATURES[feature_name], ground_heights)
 
-    return chunk, {x: s for x, s in ground_heights.items() if x in range(chunk_pos, chunk_pos+world_gen['chunk_size'])}
+    return ({x: Column(slice_) for x, slice_ in chunk.items()},
+            {x: ground_heights[x] for x in range(chunk_pos, chunk_end)})